@@ -0,0 +1,37 @@
+import numpy as np  # type: ignore
+from speech import config as cfg  # type: ignore
+from speech.env_store import EnvelopeReader  # type: ignore
+from speech.scan_store import load_result  # type: ignore
+from speech.surrogates import null_distribution, p_values  # type: ignore
+
+mfccs_ica = np.load(cfg.mfccs_ica_path)
+shifts = np.linspace(cfg.tmin, cfg.tmax, cfg.n_shifts)
+envs = EnvelopeReader(cfg.meg_env_path)
+sfreq = envs.sfreq
+
+for band in cfg.bands:
+    print(f"Testing {band} band...")
+    observed = load_result(cfg.mfcc_mi_paths[band]).mean(axis=2)
+    raw_data = envs.read(band, start=cfg.skip_samp).astype(np.float64)
+    raw_data -= raw_data.mean(axis=1, keepdims=True)
+    raw_data /= raw_data.std(axis=1, keepdims=True)
+    n_samp = raw_data.shape[1]
+    win_len_samp = int(cfg.win_len_sec * sfreq)
+    winds = np.arange(0, n_samp, win_len_samp)
+
+    null = null_distribution(
+        raw_data,
+        mfccs_ica,
+        (shifts * sfreq).astype(int),
+        winds,
+        win_len_samp,
+        cfg.n_surrogates,
+        cfg.surrogate_kind,
+        int(cfg.surrogate_param_sec * sfreq),
+        cfg.mi_backend,
+        cfg.mi_n_workers,
+        cfg.surrogate_seed,
+    )
+    p, p_max = p_values(observed, null)
+    np.savez(cfg.mfcc_mi_pvals_paths[band], mi=observed, null=null, p=p, p_max=p_max)
+envs.close()
@@ -1,25 +1,46 @@
 #!/usr/bin/env python
+"""
+Automatically annotate speech segments and optionally review them manually
 
+Speech is detected with SpeechDetector either on the audio channel of the raw
+data or on the aligned wav from 081-align_audio. Detection is headless, so all
+subjects can be processed in parallel with Hydra multirun, e.g.
+`./032-annotate_speech.py -m subject=01,02,03,04 hydra/launcher=joblib`
+(requires hydra-joblib-launcher). Set `review=true` to edit the annotations
+in the raw browser afterwards.
+
+"""
 import logging
 from dataclasses import dataclass
+from enum import Enum, auto
 from pathlib import Path
+from typing import Optional, Tuple
 
 import hydra
 import matplotlib  # type: ignore
+import mne  # type: ignore
+import numpy as np
+import soundfile as sf  # type: ignore
 from hydra.core.config_store import ConfigStore
 from mne import find_events  # type: ignore
 from mne.annotations import read_annotations  # type: ignore
 from mne.io.fiff.raw import read_raw_fif  # type: ignore
 
+from speech_detection import SpeechDetector
 from utils import AnnotMode, BaseConfig, prepare_script
 
-matplotlib.use("TkAgg")
 logger = logging.getLogger(__file__)
 
 
+class AudioSource(Enum):
+    MEG = auto()
+    WAV = auto()
+
+
 @dataclass
 class Input:
     raw: str
+    audio: str
 
 
 @dataclass
@@ -27,28 +48,70 @@ class Output:
     annots: str
 
 
+@dataclass
+class DetectorParams:
+    window_sec: float
+    extend_frames: int
+    weight: float
+    num_bins: Optional[int] = None
+
+
 @dataclass
 class Config(BaseConfig):
     input: Input
     output: Output
+    audio_ch: str
+    detector: DetectorParams
     mode: AnnotMode = AnnotMode.EDIT
+    audio_source: AudioSource = AudioSource.MEG
+    review: bool = False
 
 
 cs = ConfigStore.instance()
 cs.store(name="schema", node=Config)
 
 
+def read_audio(raw: mne.io.Raw, cfg: Config) -> Tuple[np.ndarray, float]:
+    """Read audio as 1D array and its sampling rate; wav is assumed aligned with raw"""
+    if cfg.audio_source == AudioSource.WAV:
+        audio, sr = sf.read(cfg.input.audio, dtype="float32")
+        return audio if audio.ndim == 1 else audio.mean(axis=1), sr
+    return np.squeeze(raw.get_data(picks=cfg.audio_ch)), raw.info["sfreq"]
+
+
+def detect_speech(raw: mne.io.Raw, cfg: Config) -> mne.Annotations:
+    audio, sr = read_audio(raw, cfg)
+    logger.info(f"Detecting speech in {len(audio) / sr:.1f} sec of {cfg.audio_source.name} audio")
+    detector = SpeechDetector(
+        sr,
+        window_sec=cfg.detector.window_sec,
+        extend_frames=cfg.detector.extend_frames,
+        weight=cfg.detector.weight,
+        num_bins=cfg.detector.num_bins,
+    )
+    # orig_time=None in the returned annotations syncs them to the first sample of raw
+    return detector.annotations(audio, type="speech")
+
+
 @hydra.main(config_path="../configs/", config_name="032-annotate_speech")
 def main(cfg: Config) -> None:
     prepare_script(logger, script_name=__file__)
 
     logger.info("Preparing raw data")
     raw = read_raw_fif(cfg.input.raw)
-    if Path(cfg.output.annots).exists() and cfg.mode == AnnotMode.EDIT:
+    if not Path(cfg.output.annots).exists() or cfg.mode == AnnotMode.NEW:
+        logger.info("Creating new speech annotations")
+        raw.set_annotations(detect_speech(raw, cfg))
+        logger.info(f"Auto speech annotations: {raw.annotations}")
+    else:
+        logger.info(f"Editing existing annotations at {cfg.output.annots}")
         raw.set_annotations(read_annotations(cfg.output.annots))
-    ev = find_events(raw, min_duration=1, output="step")
-    raw.pick_types(meg=False, misc=True)
-    raw.plot(block=True, events=ev, decim=20)  # pyright: ignore
+
+    if cfg.review:
+        matplotlib.use("TkAgg")
+        ev = find_events(raw, min_duration=1, output="step")
+        raw.pick_types(meg=False, misc=True)
+        raw.plot(block=True, events=ev, decim=20)  # pyright: ignore
 
     logger.info(f"Annotations: {raw.annotations}")
     raw.annotations.save(cfg.output.annots, overwrite=True)
@@ -10,7 +10,9 @@ import hydra
 import mne  # type: ignore
 from hydra.core.config_store import ConfigStore
 from mne.preprocessing import ICA  # type: ignore
+from speech.report_figures import Plot, ReportBuilder  # type: ignore
 
+from ic_sources import write_ic_sources
 from utils import BaseConfig, prepare_script
 
 logger = logging.getLogger(__name__)
@@ -26,6 +28,7 @@ class Input:
 class Output:
     report: str
     solution: str
+    sources: str
 
 
 @dataclass
@@ -53,17 +56,21 @@ class Config(BaseConfig):
     ica_init: IcaInitParams
     ica_fit: IcaFitParams
     filt: FiltParams
+    n_jobs: int
 
 
 cs = ConfigStore.instance()
 cs.store(name="schema", node=Config)
 
 
-def generate_report(ica: ICA) -> mne.Report:
-    report = mne.Report(verbose=False)
-    fig_topo = ica.plot_components(picks=range(ica.n_components_), show=False)
-    report.add_figs_to_section(fig_topo, section="ICA", captions="Timeseries")
-    return report
+def generate_report(ica: ICA, cache_dir: Path, n_jobs: int = 1) -> mne.Report:
+    # plot_components() puts up to 20 components on one figure
+    n_comp = ica.n_components_
+    picks = [range(i, min(i + 20, n_comp)) for i in range(0, n_comp, 20)]
+    topo_plots = [Plot(ica.plot_components, kwargs=dict(picks=p, show=False)) for p in picks]
+    figs = ReportBuilder(cache_dir, n_jobs)
+    figs.add_figure(topo_plots, title="ICA", caption=["Timeseries"] * len(topo_plots))
+    return figs.build()
 
 
 def compute_ica(raw: mne.io.Raw, init_cfg: IcaInitParams, fit_cfg: IcaFitParams) -> ICA:
@@ -92,8 +99,11 @@ def main(cfg: Config) -> None:
     ica.save(cfg.output.solution, overwrite=True)
     logger.info(f"Fitted ICA solution: {ica}")
 
+    logger.info("Computing IC sources...")
+    write_ic_sources(cfg.output.sources, ica, raw)
+
     logger.info("Generating report...")
-    report = generate_report(ica)
+    report = generate_report(ica, Path(cfg.output.report).parent / "figures", cfg.n_jobs)
     report.save(cfg.output.report, overwrite=True, open_browser=False)
 
 
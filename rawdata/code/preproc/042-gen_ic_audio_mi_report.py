@@ -8,11 +8,15 @@ import hydra
 import matplotlib.pyplot as plt  # type: ignore
 import mne  # type: ignore
 import numpy as np
+import scipy.fft  # type: ignore
 from hydra.core.config_store import ConfigStore
 from matplotlib.figure import Figure  # type: ignore
 from mne.preprocessing import ICA, read_ica  # type: ignore
 from sklearn.feature_selection import mutual_info_regression  # type: ignore
-from tqdm import tqdm, trange  # type: ignore
+from speech.report_figures import Plot, ReportBuilder  # type: ignore
+
+from envelopes import amplitude_env, smooth
+from ic_sources import ICSources
 from utils import BaseConfig, prepare_script
 
 logger = logging.getLogger(__file__)
@@ -22,6 +26,7 @@ logger = logging.getLogger(__file__)
 class Input:
     raw: str
     ica: str
+    sources: str
     annots: str
 
 
@@ -45,61 +50,52 @@ class Config(BaseConfig):
     mi_thresh: float
     dsamp_sfreq: float
     is_plot_envelopes: bool
+    n_jobs: int
 
 
 cs = ConfigStore.instance()
 cs.store(name="schema", node=Config)
 
 
-def amplitude_env(signal: np.ndarray, frame_size: int = 50) -> np.ndarray:
-    return np.array([max(signal[i : i + frame_size]) for i in range(len(signal))])
-
-
-def smooth(signal: np.ndarray, window: int = 50, pad_width: int = 500) -> np.ndarray:
-    sig_pad = np.pad(np.squeeze(signal), pad_width, mode="reflect")
-    smooth = np.convolve(np.squeeze(sig_pad), np.hanning(window), mode="same")
-    return smooth[pad_width:-pad_width]
-
-
 def compute_crosscorr(
     c1: np.ndarray, c2: np.ndarray, sr: float, shift_nsamp: int = 500
 ) -> Tuple[np.ndarray, np.ndarray]:
-    c1 = c1.copy()
-    c2 = c2[shift_nsamp:-shift_nsamp].copy()
-    c1 -= c1.mean()
-    c2 -= c2.mean()
-    cc1 = np.correlate(c1, c1)
-    cc2 = np.correlate(c2, c2)
+    """
+    Normalized cross-correlation of each row of c1 with c2 within +-shift_nsamp lags
+
+    c2 is trimmed by shift_nsamp at both ends and slid along full-length c1;
+    all rows are correlated at once in the frequency domain.
+
+    """
+    c1 = np.atleast_2d(c1)
+    c1 = c1 - c1.mean(axis=1, keepdims=True)
+    c2 = c2[shift_nsamp:-shift_nsamp] - c2[shift_nsamp:-shift_nsamp].mean()
+    n_fft = scipy.fft.next_fast_len(c1.shape[1], real=True)
+    spec = scipy.fft.rfft(c1, n_fft, axis=1) * np.conj(scipy.fft.rfft(c2, n_fft))
+    # reversed to keep the lag order of np.correlate(c2, c1)
+    corr = scipy.fft.irfft(spec, n_fft, axis=1)[:, 2 * shift_nsamp :: -1]
+    corr /= np.sqrt(np.sum(c1**2, axis=1, keepdims=True) * np.sum(c2**2))
     times = np.arange(-shift_nsamp, shift_nsamp + 1) / sr
-    return times, np.correlate(c2, c1) / np.sqrt(cc1 * cc2)
+    return times, corr
 
 
 def retreive_audio_envelope(raw: mne.io.Raw, audio_ch: str, dsamp_sfreq: float) -> np.ndarray:
     audio_array = raw.get_data(picks=audio_ch, reject_by_annotation="omit")
-    audio_env = smooth(amplitude_env(np.squeeze(audio_array)))[np.newaxis, :]
+    audio_env = smooth(amplitude_env(audio_array))
     audio_info = raw.info.copy().pick_channels([audio_ch])
     audio_env_smooth_raw = mne.io.RawArray(audio_env, audio_info).resample(dsamp_sfreq)
     return np.squeeze(audio_env_smooth_raw.get_data())
 
 
 def retreive_ics_envelope(
-    ica: ICA, raw: mne.io.Raw, dsamp_sfreq: float, ica_muscle_band_filt: IcaMuscleBandFilt
+    ics: ICSources, dsamp_sfreq: float, ica_muscle_band_filt: IcaMuscleBandFilt
 ) -> np.ndarray:
-    ics = ica.get_sources(raw)
-    assert isinstance(ics, mne.io.Raw)
-    ics._first_samps = raw._first_samps
-    ics._last_samps = raw._last_samps
-    del raw
-
+    ics.load_data()
     ics.resample(dsamp_sfreq)
     ics.filter(l_freq=ica_muscle_band_filt.l_freq, h_freq=ica_muscle_band_filt.h_freq)
     ics = ics.get_data(reject_by_annotation="omit")
     ics -= ics.mean(axis=1, keepdims=True)
-
-    ica_env_smooth = np.empty_like(ics)
-    for i in tqdm(range(len(ics)), desc="Computing smoothed envelopes"):
-        ica_env_smooth[i, :] = smooth(amplitude_env(ics[i, :]))
-    return ica_env_smooth
+    return smooth(amplitude_env(ics))
 
 
 def gen_mi_scores_figure(ica: ICA, mi: np.ndarray, bad_mi_inds: np.ndarray, n_comp: int) -> Figure:
@@ -108,7 +104,6 @@ def gen_mi_scores_figure(ica: ICA, mi: np.ndarray, bad_mi_inds: np.ndarray, n_co
     fig_mi.set_figwidth(10)
     fig_mi.axes[0].grid(axis="y")
     fig_mi.axes[0].xaxis.set_ticks(list(range(0, n_comp, 2)))
-    fig_mi.show()
     return fig_mi
 
 
@@ -136,7 +131,7 @@ def plot_envelopes(ica_env: np.ndarray, audio_env: np.ndarray, dsamp_sfreq: floa
 def main(cfg: Config) -> None:
     prepare_script(logger, script_name=__file__)
 
-    raw = mne.io.read_raw_fif(cfg.input.raw, preload=True)
+    raw = mne.io.read_raw_fif(cfg.input.raw)
     if Path(cfg.input.annots).exists():
         raw.set_annotations(mne.read_annotations(cfg.input.annots))
     else:
@@ -147,21 +142,25 @@ def main(cfg: Config) -> None:
 
     audio_env = retreive_audio_envelope(raw, cfg.audio_ch, cfg.dsamp_sfreq)
     ica = read_ica(cfg.input.ica)
-    ica_env = retreive_ics_envelope(ica, raw, cfg.dsamp_sfreq, cfg.ica_muscle_band_filt)
+    ics = ICSources(cfg.input.sources, ica, raw)
+    ica_env = retreive_ics_envelope(ics, cfg.dsamp_sfreq, cfg.ica_muscle_band_filt)
     logger.info("Computing mutual info.")
     mi = mutual_info_regression(ica_env.T, np.squeeze(audio_env))
     logger.info("Done")
 
-    fig_mi = gen_mi_scores_figure(ica, mi, np.nonzero(mi > cfg.mi_thresh)[0], len(ica_env))
-    report.add_figure(fig_mi, title="Muscle - audio MI")
-
-    for i_comp in trange(len(ica_env), desc="Computing cross-correlation"):
-        topo_fig = ica.plot_components(picks=i_comp, show=False)
-        report.add_figure(topo_fig, title=f"ICA {i_comp} topo")
-
-        times, corr = compute_crosscorr(ica_env[i_comp, :], audio_env, cfg.dsamp_sfreq)
-        corr_fig = gen_crosscorrelation_fig(times, corr)
-        report.add_figure(corr_fig, title=f"ICA {i_comp} - audio cross-correlation")
+    figs = ReportBuilder(Path(cfg.output.report).parent / "figures", cfg.n_jobs)
+    bad_mi_inds = np.nonzero(mi > cfg.mi_thresh)[0]
+    mi_plot = Plot(gen_mi_scores_figure, (ica, mi, bad_mi_inds, len(ica_env)))
+    figs.add_figure(mi_plot, title="Muscle - audio MI")
+
+    times, corr = compute_crosscorr(ica_env, audio_env, cfg.dsamp_sfreq)
+    for i_comp in range(len(ica_env)):
+        topo_plot = Plot(ica.plot_components, kwargs=dict(picks=i_comp, show=False))
+        figs.add_figure(topo_plot, title=f"ICA {i_comp} topo")
+        corr_plot = Plot(gen_crosscorrelation_fig, (times, corr[i_comp]))
+        figs.add_figure(corr_plot, title=f"ICA {i_comp} - audio cross-correlation")
+    logger.info("Rendering figures")
+    figs.build(report)
 
     report.save(cfg.output.report, overwrite=True)
     if cfg.is_plot_envelopes:
@@ -3,12 +3,13 @@
 import logging
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
 
 import hydra
 import mne  # type: ignore
 from hydra.core.config_store import ConfigStore
 from mne.preprocessing import read_ica  # type: ignore
+
+from ic_sources import ICSources
 from utils import BaseConfig, prepare_script, read_ica_bads, write_ica_bads
 
 logger = logging.getLogger(__file__)
@@ -18,6 +19,7 @@ logger = logging.getLogger(__file__)
 class Input:
     raw: str
     ica: str
+    sources: str
     annots: str
 
 
@@ -26,17 +28,10 @@ class Output:
     bad_ics: str
 
 
-@dataclass
-class FiltParams:
-    l_freq: Optional[int]
-    h_freq: Optional[int]
-
-
 @dataclass
 class Config(BaseConfig):
     input: Input
     output: Output
-    filt: FiltParams
 
 
 cs = ConfigStore.instance()
@@ -47,16 +42,16 @@ cs.store(name="schema", node=Config)
 def main(cfg: Config) -> None:
     prepare_script(logger, script_name=__file__)
 
-    logger.info("Loading and filtering raw data")
-    raw = mne.io.read_raw_fif(cfg.input.raw, preload=True)
-    raw.filter(l_freq=cfg.filt.l_freq, h_freq=cfg.filt.h_freq)
-
     logger.info("Loading ICA solution and setting bad components")
     ica = read_ica(cfg.input.ica)
     ica.exclude = read_ica_bads(cfg.output.bad_ics) if Path(cfg.output.bad_ics).exists() else []
     logger.info(f"ICs premarked as bad: {ica.exclude}")
 
-    ica.plot_sources(raw, block=True)
+    # sources were computed by 041 from the filtered raw; the browser reads them lazily
+    sources = ICSources(cfg.input.sources, ica, mne.io.read_raw_fif(cfg.input.raw))
+    sources.info["bads"] = [sources.ch_names[i] for i in ica.exclude]
+    sources.plot(block=True)
+    ica.exclude = [sources.ch_names.index(ch) for ch in sources.info["bads"]]
 
     logger.info("Saving bad ics")
     write_ica_bads(cfg.output.bad_ics, ica)
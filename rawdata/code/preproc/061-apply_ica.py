@@ -6,6 +6,8 @@ from dataclasses import dataclass
 import hydra
 import mne  # type: ignore
 from hydra.core.config_store import ConfigStore
+
+from lazy_raw import ProjectedRaw, ica_projection
 from utils import BaseConfig, prepare_script, read_ica_bads
 
 logger = logging.getLogger(__file__)
@@ -27,6 +29,7 @@ class Output:
 class Config(BaseConfig):
     input: Input
     output: Output
+    streaming: bool
 
 
 cs = ConfigStore.instance()
@@ -38,14 +41,18 @@ def main(cfg: Config):
     prepare_script(logger, __file__)
 
     logger.info("Loading raw")
-    raw = mne.io.read_raw_fif(cfg.input.raw, preload=True)
+    raw = mne.io.read_raw_fif(cfg.input.raw, preload=not cfg.streaming)
 
     logger.info("Loading ICA solution and setting up bad ICs")
     ica = mne.preprocessing.read_ica(cfg.input.ica)
     ica.exclude = read_ica_bads(cfg.input.bad_ics)
 
     logger.info(f"Excluding ICs {ica.exclude}")
-    ica.apply(raw)
+    if cfg.streaming:
+        # data is read, projected and written buffer by buffer during saving
+        raw = ProjectedRaw(raw, *ica_projection(ica, raw.info))
+    else:
+        ica.apply(raw)
     raw.save(cfg.output.raw, overwrite=True)
 
 
@@ -11,7 +11,7 @@ import mne  # type: ignore
 import mne.preprocessing as mne_preproc  # type: ignore
 from hydra.core.config_store import ConfigStore
 from omegaconf import OmegaConf
-from utils import AnnotMode, BaseConfig, prepare_script
+from utils import AnnotMode, BaseConfig, IcaFusion, prepare_script, read_cleaned_raw
 
 matplotlib.use("TkAgg")
 
@@ -40,6 +40,7 @@ class AnnotateMuscleParams:
 class Config(BaseConfig):
     input: Input
     output: Output
+    ica_fusion: IcaFusion
     mode: AnnotMode
     annotate_muscle_params: AnnotateMuscleParams
 
@@ -52,7 +53,8 @@ cs.store(name="schema", node=Config)
 def main(cfg: Config) -> None:
     prepare_script(logger, script_name=__file__)
 
-    raw = mne.io.read_raw_fif(cfg.input.raw, preload=True)
+    raw = read_cleaned_raw(cfg.input.raw, cfg.ica_fusion)
+    raw.load_data()
     if not Path(cfg.output.annots).exists() or cfg.mode == AnnotMode.NEW:
         logger.info("Creating new muscle annotations")
         params = OmegaConf.to_container(cfg.annotate_muscle_params)
@@ -19,7 +19,7 @@ import soundfile as sf  # type: ignore
 from hydra.core.config_store import ConfigStore
 from librosa import display
 
-from utils import BaseConfig, prepare_script
+from utils import BaseConfig, IcaFusion, prepare_script
 
 logger = logging.getLogger(__file__)
 
@@ -40,9 +40,12 @@ class Output:
 class Config(BaseConfig):
     input: Input
     output: Output
+    ica_fusion: IcaFusion
     audio_ch: str
     audio_dsamp_freq: int
     correction_samp: int
+    coarse_sfreq: int
+    min_confidence: float
     report_segments_sec: List
 
 
@@ -86,15 +89,56 @@ def scale(signal: np.ndarray) -> np.ndarray:
     return signal
 
 
-def compute_shift(audio_meg: np.ndarray, audio_lowres: np.ndarray, correction_samp: int) -> int:
+def compute_shift(
+    audio_meg: np.ndarray,
+    audio_lowres: np.ndarray,
+    sr: int,
+    correction_samp: int,
+    coarse_sfreq: int,
+) -> Tuple[int, float]:
     """
     Compute shift for audio_lowres to be aligned with audio_meg
 
-    Identical sampling rates are assumed
+    Identical sampling rates sr are assumed. The lag is first found over all
+    lags by correlating envelopes sampled at coarse_sfreq, then refined at
+    full rate on lags within two coarse samples of it, so no full-length
+    correlation of the audio is computed.
+
+    Returns shift and confidence of the coarse estimate: 1 - ratio of the
+    second highest envelope correlation peak (at least a second away) to the
+    highest one. Values close to 0 mean an ambiguous alignment.
 
     """
-    corr = scipy.signal.correlate(audio_meg, audio_lowres, mode="full")
-    return corr.argmax() - len(audio_lowres) + correction_samp
+    decim = max(1, sr // coarse_sfreq)
+    env_meg, env_lowres = block_envelope(audio_meg, decim), block_envelope(audio_lowres, decim)
+    corr = scipy.signal.correlate(env_meg, env_lowres, mode="full", method="fft")
+    peak = corr.argmax()
+    lag_coarse = (peak - len(env_lowres) + 1) * decim
+
+    excl = sr // decim
+    sidelobes = np.concatenate([corr[: max(0, peak - excl)], corr[peak + excl + 1 :]])
+    second = sidelobes.max() if len(sidelobes) else 0.0
+    confidence = float(np.clip(1 - second / corr[peak], 0, 1)) if corr[peak] > 0 else 0.0
+
+    lags = np.arange(lag_coarse - 2 * decim, lag_coarse + 2 * decim + 1)
+    fine = [lagged_dot(audio_meg, audio_lowres, lag) for lag in lags]
+    # keep the argmax - len(audio_lowres) convention correction_samp was tuned for
+    return int(lags[np.argmax(fine)]) - 1 + correction_samp, confidence
+
+
+def block_envelope(signal: np.ndarray, decim: int) -> np.ndarray:
+    """Mean absolute value over consecutive blocks of decim samples, mean removed"""
+    n_blocks = len(signal) // decim
+    env = np.abs(signal[: n_blocks * decim]).reshape(n_blocks, decim).mean(axis=1)
+    return env - env.mean()
+
+
+def lagged_dot(x: np.ndarray, y: np.ndarray, lag: int) -> float:
+    """sum_n x[n + lag] * y[n] over the overlap of the two signals"""
+    start, stop = max(0, -lag), min(len(y), len(x) - lag)
+    if start >= stop:
+        return -np.inf
+    return float(np.dot(x[start + lag : stop + lag], y[start:stop]))
 
 
 def align_audio(audio: np.ndarray, shift: int, target_duration: int) -> np.ndarray:
@@ -107,7 +151,7 @@ def align_audio(audio: np.ndarray, shift: int, target_duration: int) -> np.ndarr
 
 
 def read_meg_audio(raw_path: str, audio_ch: str) -> Tuple[np.ndarray, int]:
-    raw = mne.io.read_raw_fif(raw_path, preload=True)
+    raw = mne.io.read_raw_fif(raw_path)
     audio_meg = np.squeeze(raw.get_data(picks=audio_ch, reject_by_annotation=None))
     sr_meg = raw.info["sfreq"]
     return audio_meg, int(sr_meg)
@@ -121,14 +165,20 @@ def resample(nsamples: int, sr_from: float, sr_to: float) -> int:
 def main(cfg: Config) -> None:
     prepare_script(logger, script_name=__file__)
 
-    audio_meg, sr_meg = read_meg_audio(cfg.input.raw, cfg.audio_ch)
+    # ICA doesn't touch misc channels, so with ica_fusion audio is read from maxfiltered data
+    raw_path = cfg.ica_fusion.maxfilt_raw if cfg.ica_fusion.enabled else cfg.input.raw
+    audio_meg, sr_meg = read_meg_audio(raw_path, cfg.audio_ch)
 
     logger.info("Loading and downsampling lowres wav audio")
     audio_lowres, sr_lowres = lb.load(cfg.input.audio_hr, sr=sr_meg)
 
     logger.info("Computing lowres shift")
-    shift_lowres = compute_shift(audio_meg, audio_lowres, cfg.correction_samp)
-    logger.info(f"{shift_lowres=}")
+    shift_lowres, confidence = compute_shift(
+        audio_meg, audio_lowres, sr_meg, cfg.correction_samp, cfg.coarse_sfreq
+    )
+    logger.info(f"{shift_lowres=}, {confidence=:.3f}")
+    if confidence < cfg.min_confidence:
+        logger.warning("Ambiguous alignment: check the report before using the aligned audio")
 
     logger.info("Loading and downsampling highres wav audio")
     audio_highres, sr_highres = lb.load(cfg.input.audio_hr, sr=cfg.audio_dsamp_freq)
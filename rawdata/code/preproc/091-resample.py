@@ -3,9 +3,11 @@ import logging
 from dataclasses import dataclass
 
 import hydra
+import numpy as np
 from hydra.core.config_store import ConfigStore
-from mne.io import read_raw_fif  # type: ignore
-from utils import BaseConfig, prepare_script
+
+from lazy_raw import ResampledRaw
+from utils import BaseConfig, IcaFusion, prepare_script, read_cleaned_raw
 
 logger = logging.getLogger(__file__)
 
@@ -24,7 +26,9 @@ class Output:
 class Config(BaseConfig):
     input: Input
     output: Output
+    ica_fusion: IcaFusion
     sfreq: float
+    dtype: str
 
 
 cs = ConfigStore.instance()
@@ -35,11 +39,14 @@ cs.store(name="schema", node=Config)
 def main(cfg: Config):
     prepare_script(logger, __file__)
 
-    logger.info(f"Reading data from {cfg.input.raw}")
-    raw = read_raw_fif(cfg.input.raw)
+    # with ica_fusion maxfiltered data are cleaned and resampled in one pass
+    src = cfg.ica_fusion.maxfilt_raw if cfg.ica_fusion.enabled else cfg.input.raw
+    logger.info(f"Reading data from {src}")
+    raw = read_cleaned_raw(cfg.input.raw, cfg.ica_fusion)
 
+    # resampled chunks are computed and written buffer by buffer during saving
     logger.info("Resampling data")
-    raw.resample(sfreq=cfg.sfreq)
+    raw = ResampledRaw(raw, cfg.sfreq, np.dtype(cfg.dtype).type)
 
     logger.info(f"Saving data to {cfg.output.raw}")
     raw.save(cfg.output.raw, overwrite=True)
@@ -1,32 +1,37 @@
-import numpy as np  # type: ignore
+from mne import pick_info, pick_types  # type: ignore
 from mne.io import RawArray, read_raw_fif  # type: ignore
-from scipy.signal import hilbert  # type: ignore
 from speech import config as cfg  # type: ignore
-from tqdm import tqdm  # type: ignore
+from speech.env_store import write_envelopes  # type: ignore
 
-RESAMPLE_INITIAL = 500
-RESAMPLE_FINAL = 100
-
-
-def amplitude_env(signal, frame_size=50):
-    amps = []
+from envelopes import band_envelopes
 
-    for i in range(len(signal)):
-        amps.append(max(signal[i : i + frame_size]))
-    return np.array(amps)
+RESAMPLE_FINAL = 100
+CHUNK_SEC = 120
+N_JOBS = 4
 
 
 raw = read_raw_fif(cfg.ica_cleaned)
-raw.pick_types(meg=True)
-raw.resample(RESAMPLE_INITIAL)
-
-for band_name, band in tqdm(cfg.bands.items(), desc="Computing envelopes"):
-    raw_filt = raw.copy().filter(l_freq=band[0], h_freq=band[1])
-    raw_data = raw_filt.get_data(reject_by_annotation="omit")
-    del raw_filt
-
-    raw_data = np.abs(hilbert(raw_data))
-    raw_band = RawArray(raw_data, raw.info)
-    raw_band.resample(RESAMPLE_FINAL)
-    raw_band.save(cfg.meg_env[band_name])
-    del raw_band
+picks = pick_types(raw.info, meg=True)
+sfreq = raw.info["sfreq"]
+decim = int(round(sfreq / RESAMPLE_FINAL))
+assert decim * RESAMPLE_FINAL == sfreq, "Sampling rate must be a multiple of RESAMPLE_FINAL"
+
+envelopes = band_envelopes(
+    lambda start, stop: raw.get_data(picks, start, stop),
+    raw.n_times,
+    sfreq,
+    cfg.bands,
+    decim,
+    int(CHUNK_SEC * sfreq),
+    N_JOBS,
+)
+
+info = pick_info(raw.info, picks)
+with info._unlock():
+    info["sfreq"] = RESAMPLE_FINAL
+    info["lowpass"] = min(info["lowpass"], RESAMPLE_FINAL / 2)
+for band_name, env in envelopes.items():
+    raw_band = RawArray(env, info, first_samp=raw.first_samp // decim, verbose="ERROR")
+    raw_band.set_annotations(raw.annotations)
+    envelopes[band_name] = raw_band.get_data(reject_by_annotation="omit")
+write_envelopes(cfg.meg_env_path, envelopes, info)
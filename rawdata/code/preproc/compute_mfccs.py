@@ -1,49 +1,54 @@
 import librosa as lb  # type: ignore
-import librosa.feature as lbf  # type: ignore
 import matplotlib.pyplot as plt  # type: ignore
 import numpy as np  # type: ignore
-import scipy.interpolate as sci  # type: ignore
-from mne.io import read_raw_fif  # type: ignore
+import scipy.fft  # type: ignore
+import scipy.signal as sps  # type: ignore
 from scipy.linalg import svdvals  # type: ignore
 from sklearn.decomposition import FastICA  # type: ignore
-from sklearn.feature_selection import mutual_info_regression  # type: ignore
 from speech import config as cfg  # type: ignore
-from tqdm import tqdm  # type: ignore
+from speech.env_store import EnvelopeReader  # type: ignore
+from speech.mi import ksg_mi_matrix  # type: ignore
 
 
-def interpolated_mfcc(audio, raw_sr, raw_nsamp, audio_sr, hop, n_mfcc=7):
+def mfcc_at_rate(
+    audio, audio_sr, target_sr, n_samp, n_mfcc=7, n_fft=2048, chunk_frames=4096, out=None
+):
     """
-    Interpolate audio mfccs to match number of samples in raw
+    Compute audio mfccs directly at the sampling grid of raw
 
-    librosa.feature.mfcc() computes mfcc timeseries with a skip between
-    adjacent frames equal to hop_length argument (512 samples by default),
-    which leads to getting a downsampled output. Decreasing hop_length is not
-    an option --- array won't fit into memory. Therefore, we interpolate
-    missing mfcc samples.
+    Frame k is centered at audio sample round(k * audio_sr / target_sr), so the
+    effective hop needn't be integer and no interpolation is required.
+    Frames are processed in blocks of chunk_frames and written into out
+    (float32 array of shape (n_mfcc, n_samp), allocated if not given), which
+    keeps memory bounded regardless of the recording length.
 
-    """
-    x = np.arange(0, len(audio_wav), hop)
-    y = lbf.mfcc(y=audio_wav, sr=sr, n_mfcc=n_mfcc, hop_length=hop)
-    itp = sci.interp1d(x, y, bounds_error=False, fill_value="extrapolate")
+    Features match librosa.feature.mfcc() with center=True and reflect padding
+    except for top_db clipping, which requires the global spectrogram maximum
+    and is therefore skipped.
 
-    raw_times = np.arange(0, raw_nsamp / raw_sr, 1 / raw_sr)
-    raw_samp = (raw_times * audio_sr).astype(int)
-    return itp(raw_samp)
+    """
+    if out is None:
+        out = np.empty((n_mfcc, n_samp), dtype=np.float32)
+    window = sps.get_window("hann", n_fft, fftbins=True).astype(np.float32)
+    mel_basis = lb.filters.mel(sr=audio_sr, n_fft=n_fft).astype(np.float32)
+    offsets = np.arange(n_fft) - n_fft // 2
+    last = len(audio) - 1
+    for lo in range(0, n_samp, chunk_frames):
+        hi = min(lo + chunk_frames, n_samp)
+        centers = np.round(np.arange(lo, hi) * (audio_sr / target_sr)).astype(np.int64)
+        idx = centers[:, np.newaxis] + offsets
+        # reflect padding at the edges without copying the whole audio
+        idx = np.abs(idx)
+        idx = np.where(idx > last, 2 * last - idx, idx)
+        frames = audio[np.clip(idx, 0, last)] * window
+        power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+        mel_db = 10 * np.log10(np.maximum(power @ mel_basis.T, 1e-10))
+        out[:, lo:hi] = scipy.fft.dct(mel_db, axis=1, type=2, norm="ortho")[:, :n_mfcc].T
+    return out
 
 
 def compute_mi_matrix(signals):
-    n_comp = signals.shape[0]
-    res = np.empty((n_comp, n_comp))
-    with tqdm(total=int(n_comp * (n_comp + 1) / 2), desc="MI matrix") as pbar:
-        for i in range(n_comp):
-            for j in range(i, n_comp):
-                mi = mutual_info_regression(
-                    signals[i : i + 1, :].T, signals[j, :]
-                )
-                res[i, j] = mi
-                res[j, i] = mi
-                pbar.update(1)
-    return res
+    return ksg_mi_matrix(signals)
 
 
 def get_ica_n_components(signals, thresh=0.99):
@@ -57,15 +62,11 @@ def get_ica_n_components(signals, thresh=0.99):
 
 audio_wav, sr = lb.load(cfg.audio_align_path)
 
-band = "alpha"
-raw = read_raw_fif(cfg.meg_env[band], verbose="ERROR")
-raw_data = raw.get_data()
-raw_sr, (n_sen, raw_nsamp) = raw.info["sfreq"], raw_data.shape
+with EnvelopeReader(cfg.meg_env_path) as envs:
+    raw_sr, raw_nsamp = envs.sfreq, envs.n_times
 
 
-mfccs = interpolated_mfcc(
-    audio_wav, raw_sr, raw_nsamp, sr, cfg.hop_length, cfg.n_mfcc
-)
+mfccs = mfcc_at_rate(audio_wav, sr, raw_sr, raw_nsamp, cfg.n_mfcc, cfg.n_fft)
 
 
 mfccs = mfccs[:, cfg.skip_samp :]
@@ -74,7 +75,6 @@ mfccs /= mfccs.std(axis=1, keepdims=True)
 
 mi_mat = compute_mi_matrix(mfccs)
 
-raw_data = raw_data[:, cfg.skip_samp :]
 n_comp = get_ica_n_components(mfccs)
 transformer = FastICA(n_components=n_comp, max_iter=1000)
 mfccs_ica = transformer.fit_transform(mfccs.T).T
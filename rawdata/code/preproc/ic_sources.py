@@ -0,0 +1,73 @@
+"""
+IC source time series cached on disk
+
+Sources are computed once, chunk by chunk, and stored as a float32 .npy
+file; ICSources exposes them as a lazily read mne Raw, so stages only load the
+samples they need and the browser reads from disk while scrolling.
+
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+
+import mne  # type: ignore
+import numpy as np
+from mne.preprocessing import ICA  # type: ignore
+
+SOURCES_CHUNK_SEC = 60.0
+
+
+def write_ic_sources(path: str, ica: ICA, raw: mne.io.BaseRaw) -> None:
+    """Project raw through fitted ica and save (n_components, n_times) float32 sources"""
+    # unique temporary file, so concurrent writers don't clobber each other
+    fd, tmp_path = tempfile.mkstemp(".tmp.npy", Path(path).stem, Path(path).parent)
+    os.close(fd)
+    try:
+        shape = (int(ica.n_components_), int(raw.n_times))
+        out = np.lib.format.open_memmap(tmp_path, "w+", np.float32, shape)
+        step = int(SOURCES_CHUNK_SEC * raw.info["sfreq"])
+        for start in range(0, raw.n_times, step):
+            stop = min(start + step, raw.n_times)
+            out[:, start:stop] = ica.get_sources(raw, start=start, stop=stop).get_data()
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ICSources(mne.io.BaseRaw):
+    """
+    Raw of cached IC sources, aligned with the raw they were computed from
+
+    Channel names and types are those of ICA.get_sources(); annotations are
+    copied from raw.
+
+    """
+
+    def __init__(self, path: str, ica: ICA, raw: mne.io.BaseRaw):
+        n_comp, n_times = np.load(path, mmap_mode="r").shape
+        assert n_comp == ica.n_components_, f"{path} doesn't match the ICA solution"
+        assert n_times == raw.n_times, f"{path} doesn't match raw length"
+        info = ica.get_sources(raw, start=0, stop=1).info
+        super().__init__(
+            info,
+            first_samps=(raw.first_samp,),
+            last_samps=(raw.first_samp + n_times - 1,),
+            raw_extras=[dict(path=str(path), first_samp=raw.first_samp)],
+            orig_format="single",
+            verbose="ERROR",
+        )
+        self.set_annotations(raw.annotations)
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        # start and stop count from the first sample of the recording
+        path, first = self._raw_extras[fi]["path"], self._raw_extras[fi]["first_samp"]
+        block = np.load(path, mmap_mode="r")[:, start - first : stop - first]
+        if mult is not None:
+            data[:] = mult @ block
+        else:
+            data[:] = block[idx] * cals
@@ -0,0 +1,179 @@
+"""
+Raw transformations evaluated lazily, chunk by chunk
+
+Classes here are non-preloaded mne Raw objects computing their data from a
+source Raw on request. Raw.save() reads non-preloaded data in buffers, so
+saving them streams the transformation to disk with memory independent of the
+recording length.
+
+"""
+from __future__ import annotations
+
+from fractions import Fraction
+from typing import Tuple
+
+import mne  # type: ignore
+import numpy as np
+from mne.preprocessing import ICA  # type: ignore
+from scipy.signal import firwin, upfirdn  # type: ignore
+
+
+def ica_projection(ica: ICA, info: mne.Info) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Affine map equal to ica.apply() on channels of info
+
+    Returns picks, matrix and offset such that ica.apply() replaces
+    data[picks] with matrix @ data[picks] + offset[:, np.newaxis]. The map is
+    obtained by applying ica to unit vectors, so it follows ica.exclude and
+    all the whitening and PCA details of ICA.apply exactly.
+
+    """
+    picks = mne.pick_channels(info["ch_names"], ica.ch_names, ordered=True)
+    n_picks = len(picks)
+    basis = np.hstack([np.eye(n_picks), np.zeros((n_picks, 1))])
+    basis_raw = mne.io.RawArray(basis, mne.pick_info(info, picks), verbose="ERROR")
+    ica.apply(basis_raw, verbose="ERROR")
+    res = basis_raw.get_data()
+    offset = res[:, -1]
+    return picks, res[:, :-1] - offset[:, np.newaxis], offset
+
+
+class ProjectedRaw(mne.io.BaseRaw):
+    """Source raw with data[picks] replaced by matrix @ data[picks] + offset"""
+
+    def __init__(
+        self, src: mne.io.BaseRaw, picks: np.ndarray, matrix: np.ndarray, offset: np.ndarray
+    ):
+        cals = np.array([ch["range"] * ch["cal"] for ch in src.info["chs"]])
+        extras = dict(src=src, picks=picks, matrix=matrix, offset=offset, cals=cals)
+        super().__init__(
+            src.info.copy(),
+            first_samps=(src.first_samp,),
+            last_samps=(src.last_samp,),
+            raw_extras=[extras],
+            orig_format=src.orig_format,
+            verbose="ERROR",
+        )
+        self.set_annotations(src.annotations)
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        ex = self._raw_extras[fi]
+        first = ex["src"].first_samp
+        chunk = ex["src"].get_data(start=start - first, stop=stop - first)
+        chunk[ex["picks"]] = ex["matrix"] @ chunk[ex["picks"]] + ex["offset"][:, np.newaxis]
+        _fill_segment(data, chunk / ex["cals"][:, np.newaxis], idx, cals, mult)
+
+
+class ResampledRaw(mne.io.BaseRaw):
+    """
+    Source raw resampled to sfreq by a rational factor up / down
+
+    Data channels are filtered exactly as by scipy.signal.resample_poly on the
+    whole recording: every requested segment is computed from the source
+    samples under the anti-aliasing filter support, so chunk boundaries leave
+    no trace. Misc channels, e.g. audio, go through the same filter as MEG and
+    stay aligned with it. Stim channels are not filtered; an output sample
+    takes the maximum of the source samples it covers, so short triggers
+    survive. Annotations keep their times; events are mapped with
+    resample_events(). With dtype=np.float32 the computation is done in single
+    precision.
+
+    """
+
+    def __init__(self, src: mne.io.BaseRaw, sfreq: float, dtype: type = np.float64):
+        ratio = Fraction(sfreq / src.info["sfreq"]).limit_denominator(1000)
+        up, down = ratio.numerator, ratio.denominator
+        half = 10 * max(up, down)
+        kernel = firwin(2 * half + 1, 1 / max(up, down), window=("kaiser", 5.0)) * up
+        kernel = kernel.astype(dtype)
+        info = src.info.copy()
+        with info._unlock():
+            info["sfreq"] = sfreq
+            info["lowpass"] = min(info["lowpass"], sfreq / 2)
+        first_samp = int(round(src.first_samp * up / down))
+        n_times = -(-src.n_times * up // down)
+        cals = np.array([ch["range"] * ch["cal"] for ch in src.info["chs"]], dtype=dtype)
+        stim = mne.pick_types(src.info, meg=False, stim=True, exclude=[])
+        extras = dict(
+            src=src,
+            first_samp=first_samp,
+            up=up,
+            down=down,
+            half=half,
+            kernel=kernel,
+            cals=cals,
+            stim=stim,
+        )
+        super().__init__(
+            info,
+            first_samps=(first_samp,),
+            last_samps=(first_samp + n_times - 1,),
+            raw_extras=[extras],
+            orig_format=src.orig_format,
+            dtype=dtype,
+            verbose="ERROR",
+        )
+        self.set_annotations(src.annotations)
+
+    def resample_events(self, events: np.ndarray) -> np.ndarray:
+        """Map events found on the source raw to samples of the resampled one"""
+        ex = self._raw_extras[0]
+        events = events.copy()
+        # first output sample whose stim bin in _resample_stim holds the event sample
+        up, down = ex["up"], ex["down"]
+        i = events[:, 0] - ex["src"].first_samp
+        m = -(-i * up // down)
+        m -= m * down // up > i
+        events[:, 0] = m + ex["first_samp"]
+        return events
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        ex = self._raw_extras[fi]
+        m0, m1 = start - ex["first_samp"], stop - ex["first_samp"]
+        chunk = _resample_segment(ex["src"], m0, m1, ex["up"], ex["down"], ex["half"], ex["kernel"])
+        if len(ex["stim"]):
+            chunk[ex["stim"]] = _resample_stim(ex["src"], ex["stim"], m0, m1, ex["up"], ex["down"])
+        chunk /= ex["cals"][:, np.newaxis]
+        _fill_segment(data, chunk, idx, cals, mult)
+
+
+def _resample_segment(
+    src: mne.io.BaseRaw, m0: int, m1: int, up: int, down: int, half: int, kernel: np.ndarray
+) -> np.ndarray:
+    """Samples [m0, m1) of resample_poly(src data, up, down)"""
+    # y[m] = sum_k kernel[k] * u[m * down + half - k], u is x upsampled by up;
+    # the first source sample i0 is chosen so that upfirdn output grid hits y[m0]
+    phase = half * pow(up, -1, down) % down
+    i_first = -(-(m0 * down - half) // up)
+    i0 = i_first - (i_first - phase) % down
+    i1 = ((m1 - 1) * down + half) // up + 1
+    x = _read_padded(src, i0, i1, kernel.dtype)
+    n0 = (m0 * down + half - i0 * up) // down
+    return upfirdn(kernel, x, up, down, axis=-1)[:, n0 : n0 + m1 - m0]
+
+
+def _resample_stim(
+    src: mne.io.BaseRaw, picks: np.ndarray, m0: int, m1: int, up: int, down: int
+) -> np.ndarray:
+    """Max of source stim samples falling into each output sample in [m0, m1)"""
+    bounds = np.minimum(np.arange(m0, m1 + 1) * down // up, src.n_times)
+    x = src.get_data(picks, start=bounds[0], stop=max(bounds[-1], bounds[-2] + 1))
+    # repeated bounds (upsampling) make reduceat pick the single sample
+    return np.maximum.reduceat(x, bounds[:-1] - bounds[0], axis=1)
+
+
+def _read_padded(src: mne.io.BaseRaw, start: int, stop: int, dtype: type) -> np.ndarray:
+    """Source data in [start, stop) with zeros outside of the recording"""
+    x = np.zeros((len(src.ch_names), stop - start), dtype=dtype)
+    a, b = max(start, 0), min(stop, src.n_times)
+    if a < b:
+        x[:, a - start : b - start] = src.get_data(start=a, stop=b)
+    return x
+
+
+def _fill_segment(data, one, idx, cals, mult) -> None:
+    """Calibrate and select channels of one as mne readers do"""
+    if mult is not None:
+        data[:] = mult @ one
+    else:
+        data[:] = one[idx] * cals
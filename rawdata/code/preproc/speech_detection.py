@@ -1,49 +1,92 @@
+from __future__ import annotations
+
 from math import ceil
+from typing import Sequence
 
 import numpy as np
+import mne  # type: ignore
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy.signal import medfilt  # type: ignore
 
+FRAMES_CHUNK = 4096
+
 
 def normalize(sound: np.ndarray) -> np.ndarray:
     max = sound.max()
     return sound / max if max > 0 else sound
 
 
-def signal_energy(sound, window_length_samp):
-    assert window_length_samp > 0, "Window length must be positive integer"
-    sound = normalize(sound)
+def frame_signal(sound: np.ndarray, frame_length: int, hop: int | None = None) -> np.ndarray:
+    """
+    Strided (n_frames, frame_length) view of sound without copying
 
-    num_frames = ceil(len(sound) / window_length_samp)
-    result = np.empty(num_frames)
-    lo, hi = 0, window_length_samp
-    for i in range(num_frames):
-        result[i] = np.square(sound[lo:hi]).mean()
-        lo += window_length_samp
-        hi += window_length_samp
+    hop defaults to frame_length, i.e. non-overlapping frames.
+    The trailing incomplete frame is dropped.
 
-    return result
+    """
+    hop = frame_length if hop is None else hop
+    if len(sound) < frame_length:
+        return np.empty((0, frame_length), dtype=sound.dtype)
+    return sliding_window_view(sound, frame_length)[::hop]
 
 
-def spectral_centroid(sound, window_length_samp):
+def frames_energy(frames: np.ndarray) -> np.ndarray:
+    return np.square(frames).mean(axis=1)
+
+
+def frames_spectral_centroid(frames: np.ndarray) -> np.ndarray:
+    spec = np.abs(np.fft.rfft(frames * np.hamming(frames.shape[1]), axis=1))
+    spec_sum = spec.sum(axis=1)
+    freq_sum = spec @ np.arange(1, spec.shape[1] + 1)
+    return np.divide(freq_sum, spec_sum, out=np.zeros_like(spec_sum), where=spec_sum > 0)
+
+
+def frames_zero_crossing_rate(frames: np.ndarray) -> np.ndarray:
+    # single-sample frames have no crossings; avoid the mean of an empty diff
+    crossings = np.diff(np.signbit(frames), axis=1).sum(axis=1)
+    return crossings / max(frames.shape[1] - 1, 1)
+
+
+FRAME_FEATURES = {
+    "energy": frames_energy,
+    "centroid": frames_spectral_centroid,
+    "zcr": frames_zero_crossing_rate,
+}
+
+
+def frame_features(
+    sound: np.ndarray, window_length_samp: int, names: Sequence[str] = ("energy", "centroid")
+) -> dict[str, np.ndarray]:
+    """
+    Compute per-frame features for non-overlapping frames of normalized sound
+
+    Frames are processed in batches of FRAMES_CHUNK to bound memory used by
+    the batched rfft. The trailing incomplete frame is processed on its own,
+    so the number of frames is ceil(len(sound) / window_length_samp).
+
+    """
     assert window_length_samp > 0, "Window length must be positive integer"
-    num_frames = ceil(len(sound) / window_length_samp)
-    result = np.empty(num_frames)
     sound = normalize(sound)
+    frames = frame_signal(sound, window_length_samp)
+    tail = sound[len(frames) * window_length_samp :]
+    num_frames = ceil(len(sound) / window_length_samp)
+    result = {n: np.empty(num_frames) for n in names}
+    for lo in range(0, len(frames), FRAMES_CHUNK):
+        chunk = frames[lo : lo + FRAMES_CHUNK]
+        for n in names:
+            result[n][lo : lo + len(chunk)] = FRAME_FEATURES[n](chunk)
+    if len(tail):
+        for n in names:
+            result[n][-1] = FRAME_FEATURES[n](tail[np.newaxis, :])[0]
+    return result
 
-    lo, hi = 0, window_length_samp
-    for i in range(num_frames):
-        window = sound[lo:hi]
-        window = np.multiply(window, np.hamming(len(window)))
-        fft = np.fft.rfft(window)
-        freq_sum = sum((j + 1) * np.abs(f) for j, f in enumerate(fft))
-        fft_sum = np.abs(fft).sum()
-        result[i] = freq_sum / fft_sum if fft_sum else 0
-        print(f"{result[i]=}")
 
-        lo += window_length_samp
-        hi += window_length_samp
+def signal_energy(sound, window_length_samp):
+    return frame_features(sound, window_length_samp, ["energy"])["energy"]
 
-    return result
+
+def spectral_centroid(sound, window_length_samp):
+    return frame_features(sound, window_length_samp, ["centroid"])["centroid"]
 
 
 def smooth_signal(signal, window_length):
@@ -78,131 +121,280 @@ def max_values(hist, num_values):
     )
 
 
-def calculate_threshold(signal, max, weight):
+def calculate_threshold(mean, max, weight):
     if np.count_nonzero(max >= 0.0) < 2:
-        return np.mean(signal)
+        return mean
     return (weight * max[0] + max[1]) / (weight + 1)
 
 
+def mask_runs(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Start and stop (exclusive) indices of runs of nonzero values in mask"""
+    padded = np.concatenate(([0], np.asarray(mask, dtype=bool).view(np.int8), [0]))
+    edges = np.diff(padded)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def merge_intervals(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Merge overlapping or touching [start, stop) intervals; drop empty ones"""
+    order = np.argsort(starts, kind="stable")
+    starts, stops = starts[order], stops[order]
+    nonempty = starts < stops
+    starts, stops = starts[nonempty], stops[nonempty]
+    if not len(starts):
+        return starts, stops
+    reach = np.maximum.accumulate(stops)
+    is_new = np.concatenate(([True], starts[1:] > reach[:-1]))
+    return starts[is_new], np.maximum.reduceat(stops, np.flatnonzero(is_new))
+
+
+def speech_intervals(
+    mask: np.ndarray, sound_length: int, window_length: int, extend_length: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sample intervals covered by frame mask after post-processing
+
+    Each run of masked frames is extended by extend_length samples on both
+    sides, except at the very start and end of the mask. Intervals are
+    clipped to sound_length and merged, so the result is sorted and disjoint.
+
+    """
+    run_lo, run_hi = mask_runs(mask)
+    starts = run_lo * window_length
+    starts[run_lo > 0] -= extend_length
+    stops = run_hi * window_length
+    # the extension after a run skips the first sample, as in the original VAD
+    ext_starts = stops[run_hi < len(mask)] + 1
+    ext_stops = ext_starts - 1 + extend_length
+    starts = np.clip(np.concatenate((starts, ext_starts)), 0, sound_length)
+    stops = np.clip(np.concatenate((stops, ext_stops)), 0, sound_length)
+    return merge_intervals(starts, stops)
+
+
+def intervals_to_mask(starts: np.ndarray, stops: np.ndarray, length: int) -> np.ndarray:
+    """Boolean mask of given length from disjoint sorted [start, stop) intervals"""
+    delta = np.zeros(length + 1, dtype=np.int8)
+    delta[starts] = 1
+    delta[stops] -= 1
+    return np.cumsum(delta[:-1], dtype=np.int8).astype(bool)
+
+
 def post_process(mask, sound_length, window_length, extend_length):
-    res = [0] * sound_length
+    starts, stops = speech_intervals(mask, sound_length, window_length, extend_length)
+    return intervals_to_mask(starts, stops, sound_length)
 
-    def set(start, end):
-        start = start if start >= 0 else 0
-        end = end if end <= sound_length else sound_length
-        for i in range(start, end):
-            res[i] = 1
 
-    pos = 0
-    for i in range(len(mask)):
-        next_pos = pos + window_length
-        if mask[i]:
-            set(pos, next_pos)
-        if i > 0 and mask[i] and not mask[i - 1]:
-            set(pos - extend_length, pos)
-        if i < (len(mask) - 1) and mask[i] and not mask[i + 1]:
-            set(next_pos + 1, next_pos + extend_length)
-        pos = next_pos
+def annots_from_intervals(
+    starts: np.ndarray, stops: np.ndarray, sr: float, type: str
+) -> mne.Annotations:
+    # one sample segment counts as zero-length
+    return mne.Annotations(starts / sr, (stops - 1 - starts) / sr, [type] * len(starts))
 
-    return res
+
+def annots_from_mask(mask: np.ndarray, sr: float, type: str) -> mne.Annotations:
+    return annots_from_intervals(*mask_runs(mask), sr, type)
 
 
 class SpeechDetector:
-    def __init__(sound, sr):
-        window_nsamp = round(0.025 * sr)
-        num_bins = round(0.002 * sr)
-
-        nrg = signal_energy(sound, window_nsamp)
-        spc = spectral_centroid(sound, window_nsamp)
-
-        nrgsm = smooth_signal(nrg, 5)
-        nrghst = np.histogram(nrg, num_bins)
-        maxnrg = max_values(nrghst, 2)
-        nrgth = calculate_threshold(nrg, maxnrg, 5.0)
-
-        spcsm = smooth_signal(spc, 5)
-        spchst = np.histogram(spc, num_bins)
-        maxspc = max_values(spchst, 2)
-        spcth = calculate_threshold(spc, maxspc, 5.0)
-        # print(f"{spcth=}")
-        # spcth = 20
-        nrgmsk = nrg > nrgth
-        spcmsk = spc < spcth
-        mask = post_process(
-            np.logical_and(nrgmsk, spcmsk), len(sound), window_nsamp, 5 * window_nsamp
-        )
-
-    def _feature_mask(self, feature):
-        nrgsm = smooth_signal(nrg, 5)
-        nrghst = np.histogram(nrg, num_bins)
-        maxnrg = max_values(nrghst, 2)
-        nrgth = calculate_threshold(nrg, maxnrg, 5.0)
-
-        # if draw:
-        #     import matplotlib.pyplot as plt
-
-        #     fig, axs = plt.subplots(2, 3)
-        #     axs[0][0].plot(sound, linewidth=0.5)
-        #     axs[1][0].plot(mask, linewidth=0.7, zorder=2)
-        #     axs[1][0].plot(nrgmsk, linewidth=0.4, zorder=1)
-        #     axs[1][0].plot(spcmsk, linewidth=0.4, zorder=1)
-        #     axs[0][1].plot(nrg, linewidth=0.5, zorder=1)
-        #     axs[0][1].plot(nrgsm, linewidth=0.5, zorder=2)
-        #     axs[0][1].plot([0, len(nrg)], [nrgth, nrgth], linewidth=0.7, zorder=3)
-        #     axs[1][1].plot(spc, linewidth=0.5, zorder=1)
-        #     axs[1][1].plot(spcsm, linewidth=0.5, zorder=2)
-        #     axs[1][1].plot([0, len(spc)], [spcth, spcth], linewidth=0.7, zorder=3)
-        #     axs[0][2].bar(nrghst[1][:-1], nrghst[0], width=np.diff(nrghst[1]))
-        #     axs[1][2].bar(spchst[1][:-1], spchst[0], width=np.diff(spchst[1]))
-        #     plt.show()
-
-        return mask
-
-
-def remove_silence(sound, df):
-    mask = detect_speech(sound, df)
+    """
+    Energy and spectral centroid based speech detector for a whole waveform
+
+    Frames with energy above and spectral centroid below the thresholds
+    estimated from the features histograms are marked as speech. Speech runs
+    are extended by extend_frames frames on both sides.
+
+    """
+
+    def __init__(
+        self,
+        sr: float,
+        window_sec: float = 0.025,
+        extend_frames: int = 5,
+        weight: float = 5.0,
+        num_bins: int | None = None,
+    ):
+        self.sr = sr
+        self.window_nsamp = round(window_sec * sr)
+        self.num_bins = round(0.002 * sr) if num_bins is None else num_bins
+        self.extend_nsamp = extend_frames * self.window_nsamp
+        self.weight = weight
+
+    def detect(self, sound: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Sorted disjoint [start, stop) sample intervals of speech"""
+        feats = frame_features(sound, self.window_nsamp)
+        nrgmsk = feats["energy"] > self._threshold(feats["energy"])
+        spcmsk = feats["centroid"] < self._threshold(feats["centroid"])
+        mask = np.logical_and(nrgmsk, spcmsk)
+        return speech_intervals(mask, len(sound), self.window_nsamp, self.extend_nsamp)
+
+    def mask(self, sound: np.ndarray) -> np.ndarray:
+        return intervals_to_mask(*self.detect(sound), len(sound))
+
+    def annotations(self, sound: np.ndarray, type: str = "speech") -> mne.Annotations:
+        return annots_from_intervals(*self.detect(sound), self.sr, type)
+
+    def _threshold(self, feature: np.ndarray) -> float:
+        hist = np.histogram(feature, self.num_bins)
+        return calculate_threshold(np.mean(feature), max_values(hist, 2), self.weight)
+
+
+class StreamingSpeechDetector:
+    """
+    Online version of SpeechDetector for audio coming in chunks
+
+    Feature histograms are accumulated over fixed bin edges and the
+    thresholds are re-estimated from them on every chunk, so the whole
+    waveform is never kept in memory. Since normalization by the global
+    maximum isn't available online, energy histogram is built for log10
+    energy, which makes the estimated threshold independent of the signal
+    scale as well. Decisions for the first warmup_sec seconds are deferred
+    until enough statistics is collected.
+
+    Speech segments are returned as soon as they can't be extended by later
+    frames, i.e. with the latency of about extend_frames + 1 frames after the
+    end of speech. Unlike SpeechDetector, extension after a run is contiguous.
+
+    """
+
+    def __init__(
+        self,
+        sr: float,
+        window_sec: float = 0.025,
+        extend_frames: int = 5,
+        weight: float = 5.0,
+        warmup_sec: float = 30.0,
+        log_energy_range: tuple[float, float] = (-12.0, 2.0),
+        num_bins: int | None = None,
+    ):
+        self.sr = sr
+        self.window_nsamp = round(window_sec * sr)
+        self.extend_nsamp = extend_frames * self.window_nsamp
+        self.weight = weight
+        self.warmup_frames = ceil(warmup_sec * sr / self.window_nsamp)
+        num_bins = round(0.002 * sr) if num_bins is None else num_bins
+        self._edges = {
+            "energy": np.linspace(*log_energy_range, num_bins + 1),
+            "centroid": np.linspace(1, self.window_nsamp // 2 + 1, num_bins + 1),
+        }
+        self._counts = {n: np.zeros(num_bins, dtype=np.int64) for n in self._edges}
+        self._sums = {n: 0.0 for n in self._edges}
+        self._leftover = np.empty(0)
+        self._deferred: list[dict[str, np.ndarray]] = []
+        self._n_samples = 0  # samples consumed as complete frames
+        self._n_decided = 0  # frames with speech decision made
+        self._run_start: int | None = None  # first frame of unfinished speech run
+        self._pending: list[int] | None = None  # [start, stop) not yet final
+        self._ready: list[tuple[int, int]] = []
+
+    def push(self, chunk: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Consume next chunk of audio and return finalized speech intervals"""
+        sound = np.concatenate((self._leftover, chunk))
+        n_full = len(sound) // self.window_nsamp * self.window_nsamp
+        self._leftover = sound[n_full:]
+        self._n_samples += n_full
+        self._consume(self._features(sound[:n_full]))
+        return self._emit(final=False)
+
+    def flush(self) -> tuple[np.ndarray, np.ndarray]:
+        """Process the trailing incomplete frame and return remaining intervals"""
+        if len(self._leftover):
+            self._n_samples += len(self._leftover)
+            self._consume(self._features(self._leftover, tail=True))
+            self._leftover = np.empty(0)
+        if self._deferred:
+            self._decide(self._deferred)
+        if self._run_start is not None:
+            lo = self._run_start
+            start = lo * self.window_nsamp - (self.extend_nsamp if lo > 0 else 0)
+            self._add_interval(start, self._n_samples)
+            self._run_start = None
+        return self._emit(final=True)
+
+    def _features(self, sound: np.ndarray, tail: bool = False) -> dict[str, np.ndarray]:
+        frames = sound[np.newaxis, :] if tail else frame_signal(sound, self.window_nsamp)
+        feats = {"energy": np.empty(len(frames)), "centroid": np.empty(len(frames))}
+        for lo in range(0, len(frames), FRAMES_CHUNK):
+            block = frames[lo : lo + FRAMES_CHUNK]
+            feats["energy"][lo : lo + len(block)] = frames_energy(block)
+            feats["centroid"][lo : lo + len(block)] = frames_spectral_centroid(block)
+        feats["energy"] = np.log10(feats["energy"] + np.finfo(float).tiny)
+        return feats
+
+    def _consume(self, feats: dict[str, np.ndarray]) -> None:
+        for name, values in feats.items():
+            edges = self._edges[name]
+            self._counts[name] += np.histogram(np.clip(values, edges[0], edges[-1]), edges)[0]
+            self._sums[name] += values.sum()
+        self._deferred.append(feats)
+        if self._n_decided + sum(len(f["energy"]) for f in self._deferred) >= self.warmup_frames:
+            self._decide(self._deferred)
+
+    def _decide(self, deferred: list[dict[str, np.ndarray]]) -> None:
+        nrg = np.concatenate([f["energy"] for f in deferred])
+        spc = np.concatenate([f["centroid"] for f in deferred])
+        self._deferred = []
+        mask = np.logical_and(nrg > self._threshold("energy"), spc < self._threshold("centroid"))
+
+        in_run = self._run_start is not None
+        edges = np.diff(np.concatenate(([in_run], mask)).view(np.int8))
+        rises = self._n_decided + np.flatnonzero(edges == 1)
+        falls = self._n_decided + np.flatnonzero(edges == -1)
+        starts = np.concatenate(([self._run_start], rises)) if in_run else rises
+        if len(starts) > len(falls):
+            self._run_start, starts = int(starts[-1]), starts[:-1]
+        else:
+            self._run_start = None
+        for lo, hi in zip(starts, falls):
+            start = lo * self.window_nsamp - (self.extend_nsamp if lo > 0 else 0)
+            self._add_interval(start, hi * self.window_nsamp + self.extend_nsamp)
+        self._n_decided += len(mask)
+
+    def _threshold(self, name: str) -> float:
+        counts = self._counts[name]
+        mean = self._sums[name] / max(counts.sum(), 1)
+        return calculate_threshold(mean, max_values((counts, self._edges[name]), 2), self.weight)
+
+    def _add_interval(self, start: int, stop: int) -> None:
+        start = max(start, 0)
+        if self._pending is not None and start <= self._pending[1]:
+            self._pending[1] = max(self._pending[1], stop)
+            return
+        if self._pending is not None:
+            self._ready.append((self._pending[0], self._pending[1]))
+        self._pending = [start, stop]
+
+    def _emit(self, final: bool) -> tuple[np.ndarray, np.ndarray]:
+        if self._pending is not None:
+            # no later run can start earlier than the unfinished one or the next frame
+            next_frame = self._n_decided if self._run_start is None else self._run_start
+            if final or self._pending[1] < next_frame * self.window_nsamp - self.extend_nsamp:
+                self._ready.append((self._pending[0], self._pending[1]))
+                self._pending = None
+        ready, self._ready = self._ready, []
+        starts = np.array([lo for lo, _ in ready], dtype=np.int64)
+        stops = np.array([min(hi, self._n_samples) for _, hi in ready], dtype=np.int64)
+        return starts, stops
+
+
+def remove_silence(sound, sr):
+    mask = SpeechDetector(sr).mask(sound)
     return np.multiply(sound, mask).astype(np.int16)
 
 
 if __name__ == "__main__":
     import matplotlib
-    import mne
     from mne import create_info
     from mne.io import RawArray
     from scipy.io.wavfile import read
 
     matplotlib.use("TkAgg")
 
-    def annots_from_mask(mask: np.ndarray, sr: float, type: str) -> mne.Annotations:
-        onset = []
-        duration = []
-        description = []
-        prev_seg_start = 0 if mask[0] else None
-        prev_sample = mask[0]
-        for i, sample in enumerate(mask[1:], start=1):
-            if not prev_sample and sample:
-                prev_seg_start = i
-            elif prev_sample and not sample:
-                # one sample segment counts as zero-length
-                assert prev_seg_start is not None
-                onset.append(prev_seg_start / sr)
-                duration.append((i - 1 - prev_seg_start) / sr)
-                description.append(type)
-                prev_seg_start = None
-            prev_sample = sample
-        if prev_seg_start is not None:
-            onset.append(prev_seg_start / sr)
-            duration.append((len(mask) - 1 - prev_seg_start) / sr)
-            description.append(type)
-        return mne.Annotations(onset, duration, description)
-
     sr, sound = read("sub-01_task-speech_proc-align_beh.wav")
     print(f"Read sound of length {len(sound) / sr} with sampling rate = {sr}")
     print(f"{sound=}")
     lo, hih = 30 * sr, 350 * sr
     sound = sound.astype(float)[lo:hih]
     print("Computing audio mask")
-    mask = detect_speech(sound, sr, draw=True)
+    mask = SpeechDetector(sr).mask(sound)
     print("Done")
     print(f"{len(mask)=}")
 
@@ -10,6 +10,9 @@ from typing import Any
 
 import mne  # type: ignore
 from hydra.utils import get_original_cwd
+from mne.preprocessing import read_ica  # type: ignore
+
+from lazy_raw import ProjectedRaw, ica_projection
 
 
 class AnnotMode(Enum):
@@ -28,6 +31,30 @@ class BaseConfig:
     bids_root: str = field(default=str(Path(__file__).parent.parent.parent), init=False)
 
 
+@dataclass
+class IcaFusion:
+    enabled: bool
+    maxfilt_raw: str
+    ica: str
+    bad_ics: str
+
+
+def read_cleaned_raw(raw_path: str, fusion: IcaFusion) -> mne.io.BaseRaw:
+    """
+    Non-preloaded ICA-cleaned raw
+
+    Reads raw_path, i.e. the 061-apply_ica output, or, with fusion enabled,
+    applies the ICA to the maxfiltered raw lazily on every read.
+
+    """
+    if not fusion.enabled:
+        return mne.io.read_raw_fif(raw_path)
+    raw = mne.io.read_raw_fif(fusion.maxfilt_raw)
+    ica = read_ica(fusion.ica)
+    ica.exclude = read_ica_bads(fusion.bad_ics)
+    return ProjectedRaw(raw, *ica_projection(ica, raw.info))
+
+
 def read_bad_channels(bads_path: str) -> list[str]:
     with open(bads_path, "r") as f:
         bads = f.readline().split("\t")
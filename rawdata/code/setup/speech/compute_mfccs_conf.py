@@ -2,6 +2,13 @@ n_shifts = 11
 tmin = -1
 tmax = 1
 n_mfcc = 7
-hop_length = 512
+n_fft = 2048
 skip_samp = 2000
 win_len_sec = 120
+mi_backend = "ksg"  # "ksg" for kNN MI or "gcmi" for fast Gaussian-copula screening
+mi_n_workers = 8
+mi_sensor_block = 32
+n_surrogates = 1000
+surrogate_kind = "circular"  # "circular" shift or "block" shuffle of mfccs
+surrogate_param_sec = 10  # minimal circular shift or shuffled block length
+surrogate_seed = 0
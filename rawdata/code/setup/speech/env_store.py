@@ -0,0 +1,114 @@
+"""
+Multi-band MEG envelope container
+
+All bands of one subject are kept in a single HDF5 file as a chunked float32
+(band, sensor, time) dataset, so one band, a sensor subset or a time range is
+read without touching the rest of the file. Measurement info is saved next to
+it as a FIF file.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import h5py  # type: ignore
+import mne  # type: ignore
+import numpy as np
+
+DATASET = "envelopes"
+CHUNK_SENSORS = 32
+CHUNK_TIMES = 8192
+
+Picks = Optional[Sequence[Union[int, str]]]
+
+
+def info_path(path: Path) -> Path:
+    return Path(path).with_name(Path(path).stem + "_info.fif")
+
+
+def write_envelopes(path: Path, envelopes: Dict[str, np.ndarray], info: mne.Info) -> None:
+    """Save (n_sensors, n_times) envelope of each band; all bands must have the same shape"""
+    path = Path(path)
+    bands = list(envelopes)
+    n_ch, n_times = envelopes[bands[0]].shape
+    assert n_ch == len(info.ch_names), "Channels mismatch between envelopes and info"
+    # per-process temporary names, so concurrent writers don't clobber each other
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_info_path = path.with_name(f"{info_path(path).name}.{os.getpid()}.tmp")
+    try:
+        with h5py.File(tmp_path, "w") as f:
+            chunks = (1, min(n_ch, CHUNK_SENSORS), min(n_times, CHUNK_TIMES))
+            shape = (len(bands), n_ch, n_times)
+            dset = f.create_dataset(DATASET, shape, np.float32, chunks=chunks)
+            hashes = []
+            for i, band in enumerate(bands):
+                env = envelopes[band].astype(np.float32, copy=False)
+                dset[i] = env
+                hashes.append(hashlib.blake2b(env.tobytes()).hexdigest())
+            dset.attrs["bands"] = bands
+            dset.attrs["hashes"] = hashes
+            dset.attrs["ch_names"] = info.ch_names
+            dset.attrs["sfreq"] = info["sfreq"]
+        mne.io.write_info(tmp_info_path, info)
+        tmp_info_path.replace(info_path(path))
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        tmp_info_path.unlink(missing_ok=True)
+
+
+class EnvelopeReader:
+    """
+    Partial reads from a file saved with write_envelopes
+
+    Use as a context manager or call close() to release the file.
+
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = h5py.File(self.path, "r")
+        self._dset = self._file[DATASET]
+        attrs = self._dset.attrs
+        self.bands = [str(b) for b in attrs["bands"]]
+        self.ch_names = [str(c) for c in attrs["ch_names"]]
+        self.sfreq = float(attrs["sfreq"])
+        self.n_times = self._dset.shape[2]
+        self._hashes = dict(zip(self.bands, attrs["hashes"]))
+
+    def __enter__(self) -> EnvelopeReader:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    @property
+    def info(self) -> mne.Info:
+        return mne.io.read_info(info_path(self.path), verbose="ERROR")
+
+    def band_hash(self, band: str) -> str:
+        """Checksum of band data; changes only when the band is recomputed differently"""
+        return str(self._hashes[band])
+
+    def read(
+        self, band: str, picks: Picks = None, start: int = 0, stop: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Read (n_picks, stop - start) float32 envelope of one band
+
+        picks are channel names or indices in any order; None reads all channels.
+
+        """
+        i_band = self.bands.index(band)
+        if picks is None:
+            return self._dset[i_band, :, start:stop]
+        idx = np.array([self.ch_names.index(p) if isinstance(p, str) else p for p in picks])
+        # h5py needs increasing unique indices
+        uniq, inverse = np.unique(idx, return_inverse=True)
+        return self._dset[i_band, uniq, start:stop][inverse]
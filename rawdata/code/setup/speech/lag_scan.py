@@ -0,0 +1,170 @@
+"""
+MI scan between sensors and lagged mfccs over time windows
+
+Lagged mfccs are taken as zero-copy slices of a circularly padded buffer,
+which reproduces np.roll(mfccs, shift) without materializing a rolled copy per
+shift. KSG scan is split into (sensor block, window) tasks executed by a pool
+of processes; inputs and output live in shared memory, so nothing but task
+indices is sent between processes. With a ScanStore the output is a
+memory-mapped file instead, tiles are marked as done as soon as they are
+written and already completed tiles are skipped.
+
+"""
+from __future__ import annotations
+
+import ctypes
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm  # type: ignore
+
+from .mi import gcmi, ksg_mi
+from .scan_store import ScanStore
+
+
+class LaggedBuffer:
+    """Circularly padded signals giving np.roll(signals, shift) windows as views"""
+
+    def __init__(self, buf: np.ndarray, shifts: Sequence[int], n_samp: int):
+        self.buf = buf
+        self.shifts = np.asarray(shifts, dtype=int)
+        self.n_samp = n_samp
+        self._head = max(self.shifts.max(), 0)
+
+    @classmethod
+    def pad(cls, signals: np.ndarray, shifts: Sequence[int]) -> LaggedBuffer:
+        n_samp = signals.shape[-1]
+        head, tail = max(max(shifts), 0), max(-min(shifts), 0)
+        assert head <= n_samp and tail <= n_samp, "Shift exceeds signal length"
+        parts = [signals[..., n_samp - head :], signals, signals[..., :tail]]
+        return cls(np.concatenate(parts, axis=-1), shifts, n_samp)
+
+    def window(self, i_shift: int, start: int, stop: int) -> np.ndarray:
+        """View equal to np.roll(signals, shifts[i_shift], axis=-1)[..., start:stop]"""
+        offset = self._head - self.shifts[i_shift]
+        return self.buf[..., start + offset : stop + offset]
+
+
+def scan_ksg(
+    raw_data: np.ndarray,
+    lagged: LaggedBuffer,
+    winds: np.ndarray,
+    win_len_samp: int,
+    n_workers: int = 1,
+    sensor_block: int = 32,
+    store: Optional[ScanStore] = None,
+) -> np.ndarray:
+    """
+    KSG MI between each sensor and each shift, summed over mfccs
+
+    Returns (n_sen, n_shifts, n_windows) array.
+
+    """
+    n_sen, n_samp = raw_data.shape
+    mi_shape = (n_sen, len(lagged.shifts), len(winds))
+    ctx = mp.get_context()
+    shared = {"raw_data": _share(raw_data, ctx), "lagged": _share(lagged.buf, ctx)}
+    if store is None:
+        shared["mi"] = _share(np.zeros(mi_shape), ctx)
+        out_path = None
+    else:
+        assert store.sensor_block == sensor_block, "Sensor block differs from the store one"
+        out_path = str(store.path)
+    tasks = [
+        (i_block, lo, min(lo + sensor_block, n_sen), start, min(start + win_len_samp, n_samp), i)
+        for i, start in enumerate(winds)
+        for i_block, lo in enumerate(range(0, n_sen, sensor_block))
+        if store is None or not store.done[i_block, i]
+    ]
+    init_args = (shared, (lagged.shifts, lagged.n_samp), out_path)
+    if n_workers == 1:
+        _init_worker(*init_args)
+        results = (_ksg_task(*t) for t in tasks)
+    else:
+        pool = ProcessPoolExecutor(n_workers, ctx, _init_worker, init_args)
+        # mark tiles as soon as they finish, so an interrupted scan doesn't redo them
+        futures = [pool.submit(_ksg_task, *t) for t in tasks]
+        results = (f.result() for f in as_completed(futures))
+    for i_block, i_win in tqdm(results, total=len(tasks), desc="MI tasks"):
+        if store is not None:
+            store.mark_done(i_block, i_win)
+    if n_workers != 1:
+        pool.shutdown()
+    return _as_array(*shared["mi"]).copy() if store is None else store.open_result()
+
+
+def scan_gcmi(
+    raw_data: np.ndarray,
+    lagged: LaggedBuffer,
+    winds: np.ndarray,
+    win_len_samp: int,
+    store: Optional[ScanStore] = None,
+) -> np.ndarray:
+    """Same as scan_ksg with Gaussian-copula MI; all full windows are done at once"""
+    if store is not None and store.complete:
+        return store.open_result()
+    (n_sen, n_samp), n_shifts = raw_data.shape, len(lagged.shifts)
+    n_full = n_samp // win_len_samp
+    mi = np.zeros((n_sen, n_shifts, len(winds))) if store is None else store.open_result()
+    if n_full:
+        stop = n_full * win_len_samp
+        sen_data = raw_data[:, :stop].reshape(n_sen, n_full, win_len_samp).transpose(1, 0, 2)
+        targets = np.concatenate(
+            [
+                lagged.window(i, 0, stop).reshape(-1, n_full, win_len_samp).transpose(1, 0, 2)
+                for i in range(n_shifts)
+            ],
+            axis=1,
+        )
+        mi_full = gcmi(sen_data, targets).reshape(n_full, n_sen, n_shifts, -1).sum(axis=3)
+        mi[:, :, :n_full] = mi_full.transpose(1, 2, 0)
+    if n_full < len(winds):
+        start = winds[-1]
+        targets = np.concatenate([lagged.window(i, start, n_samp) for i in range(n_shifts)])
+        mi_last = gcmi(raw_data[:, start:], targets)
+        mi[:, :, -1] = mi_last.reshape(n_sen, n_shifts, -1).sum(axis=2)
+    if store is not None:
+        mi.flush()
+        store.mark_all_done()
+    return mi
+
+
+SharedArray = Tuple[ctypes.Array, Tuple[int, ...]]
+
+_shared: Dict[str, np.ndarray] = {}
+_lagged: Optional[LaggedBuffer] = None
+_out: Optional[np.ndarray] = None
+
+
+def _share(arr: np.ndarray, ctx: mp.context.BaseContext) -> SharedArray:
+    raw = ctx.RawArray(ctypes.c_double, arr.size)
+    _as_array(raw, arr.shape)[...] = arr
+    return raw, arr.shape
+
+
+def _as_array(raw: ctypes.Array, shape: Tuple[int, ...]) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.float64).reshape(shape)
+
+
+def _init_worker(
+    shared: Dict[str, SharedArray], lag_params: Tuple[np.ndarray, int], out_path: Optional[str]
+) -> None:
+    global _lagged, _out
+    _shared.update({name: _as_array(*arr) for name, arr in shared.items()})
+    _lagged = LaggedBuffer(_shared["lagged"], *lag_params)
+    _out = _shared["mi"] if out_path is None else np.load(out_path, mmap_mode="r+")
+
+
+def _ksg_task(
+    i_block: int, sen_lo: int, sen_hi: int, start: int, stop: int, i_win: int
+) -> Tuple[int, int]:
+    assert _lagged is not None and _out is not None, "Worker is not initialized"
+    n_shifts = len(_lagged.shifts)
+    targets = np.concatenate([_lagged.window(i, start, stop) for i in range(n_shifts)])
+    mi = ksg_mi(_shared["raw_data"][sen_lo:sen_hi, start:stop], targets, n_jobs=1)
+    _out[sen_lo:sen_hi, :, i_win] = mi.reshape(sen_hi - sen_lo, n_shifts, -1).sum(axis=2)
+    if isinstance(_out, np.memmap):
+        _out.flush()
+    return i_block, i_win
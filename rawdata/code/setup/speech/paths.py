@@ -61,8 +61,9 @@ audio_align_report_path = SPEECH_ALIGN / f"sub-{s}_proc-align_report.html"
 
 mfccs_ica_path = MFCCS / bs / "mfccs_ica.npy"
 
-meg_env = {b: MEG_ENV / (b + ".fif") for b in bands}
-mfcc_mi_paths = {b: MFCCS_MI / f"mfcc_shifts_{b}.npy" for b in bands}
+meg_env_path = MEG_ENV / bs / f"{bs}_{bt}_envelopes.h5"
+mfcc_mi_paths = {b: MFCCS_MI / bs / f"mfcc_shifts_{b}.npy" for b in bands}
+mfcc_mi_pvals_paths = {b: MFCCS_MI / bs / f"mfcc_shifts_{b}_pvals.npz" for b in bands}
 
 h5_path = BIDS_ROOT / "meg.h5"
 
@@ -90,6 +91,8 @@ ica_sol_path.parent.mkdir(exist_ok=True)
 ica_bads_path.parent.mkdir(exist_ok=True)
 ica_cleaned.parent.mkdir(exist_ok=True)
 mfccs_ica_path.parent.mkdir(exist_ok=True)
+(MFCCS_MI / bs).mkdir(exist_ok=True)
+meg_env_path.parent.mkdir(exist_ok=True)
 final_annotations.parent.mkdir(exist_ok=True)
 resampled_path.parent.mkdir(exist_ok=True)
 
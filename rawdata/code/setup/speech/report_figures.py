@@ -0,0 +1,109 @@
+"""
+Parallel cached rendering of report figures
+
+Report figures are described by Plot objects: a picklable plotting function
+with its arguments. ReportBuilder renders them to PNG in a pool of processes
+and adds the images to mne.Report in the order they were queued. Every image
+is cached under the hash of the function, its source and its arguments, so
+regenerating a report only redraws figures whose data or code changed.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import inspect
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import mne  # type: ignore
+import numpy as np
+
+
+@dataclass
+class Plot:
+    """Deferred call func(*args, **kwargs) returning matplotlib figure"""
+
+    func: Callable[..., Any]
+    args: Tuple[Any, ...] = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+    def key(self) -> str:
+        try:
+            source = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            source = ""
+        payload = (self.func, source, self.args, sorted(self.kwargs.items()))
+        return hashlib.blake2b(pickle.dumps(payload, protocol=4), digest_size=20).hexdigest()
+
+
+@dataclass
+class _Entry:
+    plots: List[Plot]
+    title: str
+    captions: Optional[List[str]]
+    is_slider: bool
+
+
+class ReportBuilder:
+    def __init__(self, cache_dir: Path, n_jobs: int = 1, dpi: int = 100):
+        self.cache_dir = Path(cache_dir)
+        self.n_jobs = n_jobs
+        self.dpi = dpi
+        self._entries: List[_Entry] = []
+
+    def add_figure(
+        self,
+        plot: Union[Plot, Sequence[Plot]],
+        title: str,
+        caption: Union[str, Sequence[str], None] = None,
+    ) -> None:
+        """Queue figure(s) with the same semantics as mne.Report.add_figure"""
+        is_slider = not isinstance(plot, Plot)
+        plots = list(plot) if is_slider else [plot]  # type: ignore
+        captions = [caption] if isinstance(caption, str) else caption
+        self._entries.append(_Entry(plots, title, list(captions) if captions else None, is_slider))
+
+    def build(self, report: Optional[mne.Report] = None) -> mne.Report:
+        """Render missing figures and add all queued figures to report"""
+        import matplotlib.image as mpimg  # type: ignore
+
+        report = mne.Report(verbose=False) if report is None else report
+        keys = [[p.key() for p in e.plots] for e in self._entries]
+        plots = {k: p for e, ks in zip(self._entries, keys) for k, p in zip(ks, e.plots)}
+        missing = [(p, self._path(k)) for k, p in plots.items() if not self._path(k).exists()]
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        dpis = [self.dpi] * len(missing)
+        if self.n_jobs == 1 or len(missing) < 2:
+            _init_worker()
+            list(map(_render, missing, dpis))
+        else:
+            with ProcessPoolExecutor(self.n_jobs, initializer=_init_worker) as pool:
+                list(pool.map(_render, missing, dpis))
+        for e, ks in zip(self._entries, keys):
+            imgs: List[np.ndarray] = [mpimg.imread(self._path(k)) for k in ks]
+            caption = e.captions if e.is_slider or e.captions is None else e.captions[0]
+            report.add_figure(imgs if e.is_slider else imgs[0], title=e.title, caption=caption)
+        return report
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.png"
+
+
+def _init_worker() -> None:
+    import matplotlib  # type: ignore
+
+    matplotlib.use("Agg")
+
+
+def _render(task: Tuple[Plot, Path], dpi: int) -> None:
+    import matplotlib.pyplot as plt  # type: ignore
+
+    plot, path = task
+    fig = plot.func(*plot.args, **plot.kwargs)
+    tmp_path = path.with_name(path.stem + ".tmp.png")
+    fig.savefig(tmp_path, dpi=dpi)
+    plt.close(fig)
+    tmp_path.replace(path)
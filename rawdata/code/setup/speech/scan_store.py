@@ -0,0 +1,78 @@
+"""
+Resumable on-disk storage for MI scan results
+
+Result is kept in a memory-mapped .npy file next to a mask of completed
+(sensor block, window) tiles and a json file with the fingerprint of scan
+inputs. Reopening the store with the same fingerprint resumes the scan from
+the missing tiles; a changed fingerprint resets the store.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+
+
+class ScanStore:
+    def __init__(
+        self,
+        path: Path,
+        shape: Tuple[int, int, int],
+        sensor_block: int,
+        fingerprint: str,
+    ):
+        self.path = Path(path)
+        self.done_path = _done_path(self.path)
+        self.meta_path = self.path.with_name(self.path.stem + "_meta.json")
+        self.sensor_block = sensor_block
+        n_blocks = -(-shape[0] // sensor_block)
+        meta = {"fingerprint": fingerprint, "shape": list(shape), "sensor_block": sensor_block}
+        if self._read_meta() != meta:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            np.lib.format.open_memmap(self.path, "w+", np.float64, shape).flush()
+            np.save(self.done_path, np.zeros((n_blocks, shape[2]), dtype=bool))
+            self.meta_path.write_text(json.dumps(meta))
+        self.done = np.load(self.done_path, mmap_mode="r+")
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.done.all())
+
+    def open_result(self) -> np.memmap:
+        return np.load(self.path, mmap_mode="r+")
+
+    def mark_done(self, i_block: int, i_win: int) -> None:
+        self.done[i_block, i_win] = True
+        self.done.flush()
+
+    def mark_all_done(self) -> None:
+        self.done[...] = True
+        self.done.flush()
+
+    def _read_meta(self) -> Dict[str, Any]:
+        if not (self.meta_path.exists() and self.path.exists() and self.done_path.exists()):
+            return {}
+        return json.loads(self.meta_path.read_text())
+
+
+def load_result(path: Path) -> np.ndarray:
+    """Result of a finished scan; raises if the scan at path was interrupted"""
+    done_path = _done_path(Path(path))
+    if not done_path.exists() or not np.load(done_path).all():
+        raise RuntimeError(f"MI scan in {path} is incomplete; rerun the scan to finish it")
+    return np.load(path)
+
+
+def _done_path(path: Path) -> Path:
+    return path.with_name(path.stem + "_done.npy")
+
+
+def fingerprint(input_paths: Sequence[Path], params: Dict[str, Any]) -> str:
+    """Hash of input files size and mtime together with scan parameters"""
+    stats = [(str(p), p.stat().st_size, p.stat().st_mtime_ns) for p in map(Path, input_paths)]
+    payload = json.dumps({"inputs": stats, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
@@ -0,0 +1,151 @@
+"""
+Permutation test for the sensor-mfcc MI scan
+
+Surrogate mfccs are circularly shifted or block-shuffled copies of the real
+ones; each surrogate is run through the same lagged scan as the real data and
+gives one sample of the null distribution of the window-averaged MI for every
+sensor and shift. Sensor windows are rank-transformed (gcmi) or scaled and
+sorted (ksg) once in the parent and shared with the worker processes, so for
+each surrogate only the mfcc side is recomputed. Every surrogate draws from its
+own child of one SeedSequence, so the null doesn't depend on scheduling.
+
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm  # type: ignore
+
+from .lag_scan import LaggedBuffer, SharedArray, _as_array, _share
+from .mi import copnorm, gcmi_copnormed, ksg_mi_prepared, ksg_prepare
+
+Surrogate = Callable[[np.ndarray, np.random.Generator, int], np.ndarray]
+
+
+def circular_shift(signals: np.ndarray, rng: np.random.Generator, min_shift: int) -> np.ndarray:
+    """Roll signals by a random offset at least min_shift samples away from zero"""
+    n_samp = signals.shape[-1]
+    # min_shift = 0 would allow the identity surrogate, i.e. the observed data
+    assert min_shift > 0, "Minimal shift must be positive"
+    assert 2 * min_shift < n_samp, "Minimal shift is too large for the signal length"
+    return np.roll(signals, rng.integers(min_shift, n_samp - min_shift + 1), axis=-1)
+
+
+def block_shuffle(signals: np.ndarray, rng: np.random.Generator, block_len: int) -> np.ndarray:
+    """Cut signals into blocks of block_len samples and put them in random order"""
+    assert block_len > 0, "Block length must be positive"
+    blocks = np.array_split(signals, np.arange(block_len, signals.shape[-1], block_len), axis=-1)
+    return np.concatenate([blocks[i] for i in rng.permutation(len(blocks))], axis=-1)
+
+
+SURROGATES: Dict[str, Surrogate] = {"circular": circular_shift, "block": block_shuffle}
+
+
+def null_distribution(
+    raw_data: np.ndarray,
+    mfccs: np.ndarray,
+    shifts: Sequence[int],
+    winds: np.ndarray,
+    win_len_samp: int,
+    n_surrogates: int,
+    kind: str,
+    kind_param: int,
+    backend: str = "ksg",
+    n_workers: int = 1,
+    seed: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Window-averaged MI for surrogate mfccs
+
+    Parameters
+    ----------
+    raw_data : (n_sen, n_samp) standardized sensor data
+    mfccs : (n_mfcc, n_samp) array
+    shifts : mfcc shifts in samples, as for LaggedBuffer.pad
+    winds, win_len_samp : windows starts and length, as for the scan
+    n_surrogates : size of the null distribution
+    kind : key of SURROGATES
+    kind_param : min_shift for "circular" or block_len for "block", in samples
+    backend : "ksg" or "gcmi"
+    n_workers : number of processes
+    seed : seed of the surrogates and of the ksg tie-breaking noise
+
+    Returns
+    -------
+    null : (n_surrogates, n_sen, n_shifts) array
+
+    """
+    assert kind_param > 0, "Surrogate parameter must be a positive number of samples"
+    n_samp = raw_data.shape[1]
+    spans = [(start, min(start + win_len_samp, n_samp)) for start in winds]
+    root = np.random.SeedSequence(seed)
+    ctx = mp.get_context()
+    shared = {"mfccs": _share(mfccs, ctx)}
+    if backend == "gcmi":
+        sensors = np.concatenate([copnorm(raw_data[:, a:b]) for a, b in spans], axis=1)
+        shared["sensors"] = _share(sensors, ctx)
+    else:
+        rng = np.random.default_rng(root.spawn(1)[0])
+        prep = [ksg_prepare(raw_data[:, a:b], rng) for a, b in spans]
+        shared["sensors"] = _share(np.concatenate([p[0] for p in prep], axis=1), ctx)
+        shared["sensors_sorted"] = _share(np.concatenate([p[1] for p in prep], axis=1), ctx)
+    params = dict(
+        shifts=np.asarray(shifts), spans=spans, kind=kind, kind_param=kind_param, backend=backend
+    )
+    seeds = root.spawn(n_surrogates)
+    init_args = (shared, params)
+    if n_workers == 1:
+        _init_worker(*init_args)
+        results = map(_null_task, seeds)
+    else:
+        pool = ProcessPoolExecutor(n_workers, ctx, _init_worker, init_args)
+        results = pool.map(_null_task, seeds, chunksize=max(1, n_surrogates // (8 * n_workers)))
+    null = np.stack(list(tqdm(results, total=n_surrogates, desc="Surrogates")))
+    if n_workers != 1:
+        pool.shutdown()
+    return null
+
+
+def p_values(observed: np.ndarray, null: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Permutation p-values of observed statistic against the null distribution
+
+    Returns uncorrected p-values and p-values corrected for multiple comparisons
+    across all sensors and shifts with the maximum statistic.
+
+    """
+    n = len(null)
+    p = (1 + (null >= observed).sum(axis=0)) / (n + 1)
+    null_max = null.reshape(n, -1).max(axis=1)
+    p_max = (1 + (null_max >= observed[..., np.newaxis]).sum(axis=-1)) / (n + 1)
+    return p, p_max
+
+
+_shared: Dict[str, np.ndarray] = {}
+_params: Dict[str, Any] = {}
+
+
+def _init_worker(shared: Dict[str, SharedArray], params: Dict[str, Any]) -> None:
+    _shared.update({name: _as_array(*arr) for name, arr in shared.items()})
+    _params.update(params)
+
+
+def _null_task(seed: np.random.SeedSequence) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    shifts, spans = _params["shifts"], _params["spans"]
+    surrogate = SURROGATES[_params["kind"]](_shared["mfccs"], rng, _params["kind_param"])
+    lagged = LaggedBuffer.pad(surrogate, shifts)
+    n_sen = _shared["sensors"].shape[0]
+    res = np.zeros((n_sen, len(shifts)))
+    for a, b in spans:
+        targets = np.concatenate([lagged.window(i, a, b) for i in range(len(shifts))])
+        if _params["backend"] == "gcmi":
+            mi = gcmi_copnormed(_shared["sensors"][:, a:b], copnorm(targets))
+        else:
+            sensors = _shared["sensors"][:, a:b], _shared["sensors_sorted"][:, a:b]
+            mi = ksg_mi_prepared(sensors, ksg_prepare(targets, rng), n_jobs=1)
+        res += mi.reshape(n_sen, len(shifts), -1).sum(axis=2)
+    return res / len(spans)
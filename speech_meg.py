@@ -1,17 +1,31 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Iterator, Tuple
 
-import hydra
+import h5py  # type: ignore
 import librosa as lb  # type: ignore
 import mne  # type: ignore
 import numpy as np
 import numpy.typing as npt
+import soundfile as sf  # type: ignore
 from ndp.signal import Signal, Signal1D
 from ndp.signal.annotations import Annotation, Annotations
+from omegaconf import DictConfig, OmegaConf
 
 BIDS_ROOT = Path(__file__).parent / "rawdata"
+CONFIGS_DIR = BIDS_ROOT / "code" / "configs"
+MMAP_CHUNK_SEC = 60.0
+CACHE_VERSION = 1
+HASH_CHUNK_BYTES = 1 << 24
 
 
 @dataclass
@@ -20,21 +34,218 @@ class Info:
     mne_info: mne.Info
 
 
-def read_subject(subject: str) -> tuple[Signal[npt._32Bit], Signal1D[npt._32Bit], Info]:
-    with hydra.initialize(config_path="rawdata/code/configs"):
-        overrides = [f"bids_root={str(BIDS_ROOT)}", f"+subject={subject}"]
-        paths = hydra.compose(config_name="paths", overrides=overrides)
+Dataset = Tuple["Signal[npt._32Bit]", "Signal1D[npt._32Bit]", "Info"]
+
+
+def read_subject(
+    subject: str, mmap: bool = False, cache: bool = False
+) -> tuple[Signal[npt._32Bit], Signal1D[npt._32Bit], Info]:
+    """
+    Read MEG, aligned audio and annotations for subject
+
+    With mmap=True MEG data are memory-mapped from a time-major float32 copy of
+    the resampled FIF, which is written on the first call and rewritten
+    whenever size or mtime of the FIF differ from those it was converted from.
+
+    With cache=True MEG, audio and annotations are read from a per-subject HDF5
+    container, which is rebuilt when any of the source files changes. Sources
+    are compared by size and mtime first; their content hash is only
+    recomputed when mtime differs, so that e.g. a fresh ``dvc checkout`` of the
+    same data doesn't trigger the rebuild.
+
+    """
+    paths = _subject_paths(subject)
+    if cache:
+        return _read_cached(paths["cache"].h5, _cache_sources(paths), mmap)
+    mmap_path = paths["cache"].meg if mmap else None
+    return _read_dataset(
+        paths["091-resample"].raw,
+        paths["081-align_audio"].aligned_audio,
+        paths["101-merge_annotations"].annots,
+        mmap_path,
+    )
+
+
+def read_subjects(
+    subjects: list[str], n_workers: int = 1, mmap: bool = False, cache: bool = False
+) -> list[Dataset]:
+    """
+    Read several subjects concurrently in a pool of n_workers processes
+
+    Results are returned in the order of subjects. For mmap=True workers
+    prepare on-disk copies of MEG data, which are then memory-mapped in the
+    calling process instead of being pickled back; audio is decoded in the
+    workers only. A subject listed several times is read once and the same
+    dataset object is returned for each occurrence.
+
+    On-disk copies and caches are written to per-process temporary files and
+    moved into place atomically, so concurrent loads of the same subject, from
+    this or other jobs, are safe; they may only convert it more than once.
+
+    """
+    unique = list(dict.fromkeys(subjects))
+    if n_workers == 1:
+        datasets = {s: read_subject(s, mmap, cache) for s in unique}
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            futures = {s: pool.submit(_read_subject_worker, s, mmap, cache) for s in unique}
+            datasets = {s: _result(s, f, mmap, cache) for s, f in futures.items()}
+    return [datasets[s] for s in subjects]
+
+
+def iter_subjects(
+    subjects: list[str], prefetch: int = 1, mmap: bool = False, cache: bool = False
+) -> Iterator[Dataset]:
+    """
+    Yield subjects one by one, loading up to prefetch next ones in background
+
+    Safe to run concurrently with other loaders of the same subjects; see
+    read_subjects.
+
+    """
+    assert prefetch > 0, "Prefetch depth must be positive integer"
+    with ProcessPoolExecutor(prefetch) as pool:
+        queue: deque[tuple[str, Future]] = deque()
+        for subject in subjects:
+            queue.append((subject, pool.submit(_read_subject_worker, subject, mmap, cache)))
+            if len(queue) > prefetch:
+                yield _result(*queue.popleft(), mmap, cache)
+        while queue:
+            yield _result(*queue.popleft(), mmap, cache)
+
+
+def iter_windows(
+    subject: str,
+    win_sec: float,
+    hop_sec: float | None = None,
+    shuffle: bool = False,
+    seed: int | None = None,
+) -> Iterator[tuple[npt.NDArray[np.float32], npt.NDArray[np.float32], Annotations]]:
+    """
+    Yield aligned (meg, audio, annotations) windows of win_sec seconds
+
+    Window starts are spaced by hop_sec (defaults to win_sec) on the MEG
+    sample grid and mapped onto the audio grid with the ratio of sampling
+    rates, so MEG and audio windows cover the same time span, each with its
+    own sampling rate. MEG is read from the memory-mapped copy (see
+    read_subject) and audio is read from disk window by window, so memory use
+    is bounded by the window size. Multichannel audio is averaged to mono as
+    in read_subject. Annotations are clipped to the window and their onsets are given
+    relative to the window start. The last incomplete window is dropped.
+
+    """
+    hop_sec = win_sec if hop_sec is None else hop_sec
+    assert win_sec > 0 and hop_sec > 0, "Window length and hop must be positive"
+    paths = _subject_paths(subject)
+    raw_path = paths["091-resample"].raw
+    raw = mne.io.read_raw_fif(raw_path, verbose="ERROR")
+    raw.set_annotations(mne.read_annotations(paths["101-merge_annotations"].annots))
+    meg = _load_meg_mmap(raw, raw_path, paths["cache"].meg)
+    annots = _annotations_from_raw(raw)
+    sfreq = raw.info["sfreq"]
+
+    with sf.SoundFile(paths["081-align_audio"].aligned_audio) as audio:
+        audio_ratio = audio.samplerate / sfreq
+        win_nsamp, hop_nsamp = int(win_sec * sfreq), int(hop_sec * sfreq)
+        audio_win_nsamp = int(win_nsamp * audio_ratio)
+        n_samp = min(len(meg), int(audio.frames / audio_ratio))
+        starts = np.arange(0, n_samp - win_nsamp + 1, hop_nsamp)
+        if shuffle:
+            np.random.default_rng(seed).shuffle(starts)
+        for start in starts:
+            audio.seek(int(start * audio_ratio))
+            audio_win = audio.read(audio_win_nsamp, dtype="float32", always_2d=True)
+            t_start = start / sfreq
+            yield (
+                np.array(meg[start : start + win_nsamp]),
+                audio_win.mean(axis=1, keepdims=True),
+                _crop_annotations(annots, t_start, t_start + win_nsamp / sfreq),
+            )
+
+
+def _crop_annotations(annots: Annotations, tmin: float, tmax: float) -> Annotations:
+    res = []
+    for onset, duration, type in annots:
+        lo, hi = max(onset, tmin), min(onset + duration, tmax)
+        if lo < hi or (duration == 0 and tmin <= onset < tmax):
+            res.append(Annotation(lo - tmin, hi - lo if duration else 0, type))
+    return res
+
+
+@lru_cache(maxsize=None)
+def _subject_paths(subject: str, bids_root: str = str(BIDS_ROOT)) -> DictConfig:
+    """
+    Resolve paths.yaml for subject with plain OmegaConf
+
+    Equivalent to composing "paths" with Hydra and "+subject=<subject>" override
+    but avoids Hydra initialization and its global state. The result is
+    memoized and read-only.
+
+    """
+    paths = OmegaConf.load(CONFIGS_DIR / "paths.yaml")
+    del paths["defaults"]
+    subject_cfg = OmegaConf.load(CONFIGS_DIR / "subject" / f"{subject}.yaml")
+    cfg = OmegaConf.merge(paths, subject_cfg, {"bids_root": bids_root})
+    OmegaConf.resolve(cfg)
+    OmegaConf.set_readonly(cfg, True)
+    return cfg
+
+
+def _cache_sources(paths: DictConfig) -> dict[str, str]:
+    return {
+        "raw": paths["091-resample"].raw,
+        "audio": paths["081-align_audio"].aligned_audio,
+        "annots": paths["101-merge_annotations"].annots,
+    }
+
+
+def _read_subject_worker(subject: str, mmap: bool, cache: bool) -> Any:
+    """
+    Load subject in a pool process
+
+    With mmap only small parts of the dataset are sent back: nothing for the
+    cache, which the parent maps after it is rebuilt here, and audio,
+    annotations and info otherwise, with MEG left in the on-disk copy.
+
+    """
+    if not mmap:
+        return read_subject(subject, mmap, cache)
+    paths = _subject_paths(subject)
+    if cache:
+        sources = _cache_sources(paths)
+        if not _is_cache_valid(paths["cache"].h5, sources):
+            _write_cache(paths["cache"].h5, sources)
+        return None
     raw_path = paths["091-resample"].raw
-    audio_path = paths["081-align_audio"].aligned_audio
-    annotations_path = paths["101-merge_annotations"].annots
-    return _read_dataset(raw_path, audio_path, annotations_path)
+    raw = mne.io.read_raw_fif(raw_path, verbose="ERROR")
+    raw.set_annotations(mne.read_annotations(paths["101-merge_annotations"].annots))
+    _load_meg_mmap(raw, raw_path, paths["cache"].meg)
+    audio = _read_wav(paths["081-align_audio"].aligned_audio)
+    return audio, _annotations_from_raw(raw), Info(raw.info)
+
+
+def _result(subject: str, future: Future, mmap: bool, cache: bool) -> Dataset:
+    result = future.result()
+    if not mmap:
+        return result
+    if cache:
+        return read_subject(subject, mmap, cache)
+    Y, annots, info = result
+    X_data = np.load(_subject_paths(subject)["cache"].meg, mmap_mode="r")
+    return _combine(Signal(X_data, info.mne_info["sfreq"], annots), Y, info)
 
 
 def _read_dataset(
-    raw_path: str, audio_path: str, annotations_path: str
+    raw_path: str, audio_path: str, annotations_path: str, mmap_path: str | None = None
 ) -> tuple[Signal[npt._32Bit], Signal1D[npt._32Bit], Info]:
-    X, info = _read_raw(raw_path, annotations_path)
+    X, info = _read_raw(raw_path, annotations_path, mmap_path)
     Y = _read_wav(audio_path)
+    return _combine(X, Y, info)
+
+
+def _combine(
+    X: Signal[npt._32Bit], Y: Signal1D[npt._32Bit], info: Info
+) -> tuple[Signal[npt._32Bit], Signal1D[npt._32Bit], Info]:
     Y.annotations = X.annotations
     assert abs(X.duration - Y.duration) < 0.01, "inconsistent durations for audio and MEG"
     return X, Y, info
@@ -45,15 +256,223 @@ def _read_wav(path: str, sr: int | None = None) -> Signal1D[npt._32Bit]:
     return Signal1D(data[:, np.newaxis], sr_final, [])
 
 
-def _read_raw(raw_path: str, annot_path: str | None) -> tuple[Signal[npt._32Bit], Info]:
-    raw = mne.io.read_raw_fif(raw_path, verbose="ERROR", preload=True)
+def _read_raw(
+    raw_path: str, annot_path: str | None, mmap_path: str | None = None
+) -> tuple[Signal[npt._32Bit], Info]:
+    raw = mne.io.read_raw_fif(raw_path, verbose="ERROR", preload=mmap_path is None)
     if annot_path is not None:
         annots = mne.read_annotations(annot_path)
         raw.set_annotations(annots)
-    X_data = raw.get_data(picks="meg").astype("float32").T
+    if mmap_path is None:
+        X_data = raw.get_data(picks="meg").astype("float32").T
+    else:
+        X_data = _load_meg_mmap(raw, raw_path, mmap_path)
     return Signal(X_data, raw.info["sfreq"], _annotations_from_raw(raw)), Info(raw.info)
 
 
+def _load_meg_mmap(raw: mne.io.BaseRaw, raw_path: str, mmap_path: str) -> np.memmap:
+    """Memory-map time-major float32 MEG data, converting from FIF if stale"""
+    path = Path(mmap_path)
+    key_path = path.with_suffix(".source.json")
+    # any change of the source key counts: checkouts and restores may set older mtimes
+    key = _file_key(raw_path)
+    if not path.exists() or _read_json(key_path) != key:
+        _write_meg_npy(raw, path)
+        tmp_path = _tmp_path(key_path)
+        tmp_path.write_text(json.dumps(key))
+        os.replace(tmp_path, key_path)
+    return np.load(path, mmap_mode="r")
+
+
+def _read_json(path: Path) -> Any:
+    """Contents of JSON file or None when it is missing or unreadable"""
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meg_npy(raw: mne.io.BaseRaw, path: Path) -> None:
+    """Write MEG channels of non-preloaded raw to .npy chunk by chunk"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(path)
+    try:
+        out = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype="float32", shape=_meg_shape(raw)
+        )
+        _copy_meg(raw, out)
+        out.flush()
+        del out
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _tmp_path(path: Path) -> Path:
+    """
+    Fresh temporary file next to path
+
+    Every writer gets its own file, so processes converting the same subject
+    at once don't clobber each other and the last os.replace wins.
+
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".tmp" + path.suffix, prefix=path.stem + ".", dir=path.parent)
+    os.close(fd)
+    return Path(tmp)
+
+
+def _meg_shape(raw: mne.io.BaseRaw) -> tuple[int, int]:
+    return int(raw.n_times), len(mne.pick_types(raw.info, meg=True, exclude=[]))
+
+
+def _copy_meg(raw: mne.io.BaseRaw, out: npt.ArrayLike) -> None:
+    """Copy MEG channels of raw to time-major array-like out in time chunks"""
+    picks = mne.pick_types(raw.info, meg=True, exclude=[])
+    chunk_nsamp = int(MMAP_CHUNK_SEC * raw.info["sfreq"])
+    for start in range(0, raw.n_times, chunk_nsamp):
+        stop = min(start + chunk_nsamp, raw.n_times)
+        out[start:stop] = raw.get_data(picks=picks, start=start, stop=stop).T  # type: ignore
+
+
+def _read_cached(
+    cache_path: str, sources: dict[str, str], mmap: bool
+) -> tuple[Signal[npt._32Bit], Signal1D[npt._32Bit], Info]:
+    if not _is_cache_valid(cache_path, sources):
+        _write_cache(cache_path, sources)
+    with h5py.File(cache_path, "r") as f:
+        if mmap:
+            X_data = _h5_memmap(cache_path, f["meg"])
+        else:
+            X_data = f["meg"][()]
+        Y_data = f["audio"][()]
+        sfreq, audio_sr = f.attrs["sfreq"], f.attrs["audio_sr"]
+        annots = [
+            Annotation(o, d, t)
+            for o, d, t in zip(
+                f["annotations/onset"][()],
+                f["annotations/duration"][()],
+                f["annotations/description"].asstr()[()],
+            )
+        ]
+    X = Signal(X_data, sfreq, annots)
+    Y = Signal1D(Y_data, audio_sr, [])
+    return _combine(X, Y, Info(mne.io.read_info(sources["raw"], verbose="ERROR")))
+
+
+def _h5_memmap(cache_path: str, dataset: h5py.Dataset) -> np.memmap:
+    """Memory-map contiguous uncompressed HDF5 dataset bypassing h5py"""
+    offset = dataset.id.get_offset()
+    assert offset is not None, f"{dataset.name} in {cache_path} is not contiguous"
+    return np.memmap(cache_path, dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+
+
+def _write_cache(cache_path: str, sources: dict[str, str]) -> None:
+    """Convert subject sources into contiguous float32 datasets of one HDF5 file"""
+    raw = mne.io.read_raw_fif(sources["raw"], verbose="ERROR")
+    raw.set_annotations(mne.read_annotations(sources["annots"]))
+    annots = _annotations_from_raw(raw)
+    audio, audio_sr = lb.load(sources["audio"], sr=None)  # pyright: ignore
+
+    path = Path(cache_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(path)
+    try:
+        with h5py.File(tmp_path, "w") as f:
+            f.attrs["version"] = CACHE_VERSION
+            f.attrs["sfreq"] = raw.info["sfreq"]
+            f.attrs["audio_sr"] = audio_sr
+            _copy_meg(raw, f.create_dataset("meg", shape=_meg_shape(raw), dtype="float32"))
+            f.create_dataset("audio", data=audio.astype("float32")[:, np.newaxis])
+            f.create_dataset("annotations/onset", data=[a[0] for a in annots], dtype="float64")
+            f.create_dataset(
+                "annotations/duration", data=[a[1] for a in annots], dtype="float64"
+            )
+            f.create_dataset(
+                "annotations/description", data=[a[2] for a in annots], dtype=h5py.string_dtype()
+            )
+            for name, src in sources.items():
+                f.create_group(f"sources/{name}").attrs.update(_file_key(src, with_hash=True))
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # lost the race to a concurrent writer, e.g. when the cache is open on Windows
+            if not _is_cache_valid(cache_path, sources):
+                raise
+        else:
+            # mtimes refreshed for the previous cache don't describe the new one
+            _mtimes_path(cache_path).unlink(missing_ok=True)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _is_cache_valid(cache_path: str, sources: dict[str, str]) -> bool:
+    """
+    Check cache against sources without write access
+
+    The HDF5 file is never modified after it is written, so any number of
+    processes can read it at once. Sources whose mtime changed but content
+    didn't get their new mtime stored in a JSON sidecar when the directory is
+    writable, so the hash isn't recomputed on the next call.
+
+    """
+    if not Path(cache_path).exists():
+        return False
+    refreshed: dict[str, int] = _read_json(_mtimes_path(cache_path)) or {}
+    touched: dict[str, int] = {}
+    with h5py.File(cache_path, "r") as f:
+        if f.attrs.get("version") != CACHE_VERSION:
+            return False
+        for name, src in sources.items():
+            if f"sources/{name}" not in f:
+                return False
+            cached, current = f[f"sources/{name}"].attrs, _file_key(src)
+            if cached["size"] != current["size"]:
+                return False
+            if refreshed.get(name, cached["mtime_ns"]) != current["mtime_ns"]:
+                if cached["hash"] != _file_hash(src):
+                    return False
+                touched[name] = int(current["mtime_ns"])
+    if touched:
+        _update_mtimes(cache_path, {**refreshed, **touched})
+    return True
+
+
+def _mtimes_path(cache_path: str) -> Path:
+    return Path(cache_path).with_suffix(".mtimes.json")
+
+
+def _update_mtimes(cache_path: str, mtimes: dict[str, int]) -> None:
+    """Store new source mtimes; skipped when the cache directory is read-only"""
+    path = _mtimes_path(cache_path)
+    try:
+        tmp_path = _tmp_path(path)
+    except OSError:
+        return
+    try:
+        tmp_path.write_text(json.dumps(mtimes))
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _file_key(path: str, with_hash: bool = False) -> dict[str, int | str]:
+    stat = Path(path).stat()
+    key: dict[str, int | str] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        key["hash"] = _file_hash(path)
+    return key
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            h.update(chunk)
+    return h.hexdigest()
+
+
 def _annotations_from_raw(raw: mne.io.BaseRaw) -> Annotations:
     if not hasattr(raw, "annotations"):
         return []